@@ -0,0 +1,56 @@
+"""Micro-benchmark: the store's JSON codec vs. the json module.
+
+Loads data_store.json, checks that every entry round-trips exactly through
+SQLite (import → export), then times decoding, encoding and the export.
+
+    python benchmarks/bench_codec.py [rounds]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from codec import CODEC, dumps, loads
+from storage import EntryStore
+
+DATA_FILE = os.path.join(ROOT, "data_store.json")
+
+def timed(label, fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"  {label:34s} {elapsed * 1000:8.1f} ms")
+    return result
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with open(DATA_FILE, "rb") as f:
+        raw = f.read()
+    entries = json.loads(raw)
+    print(f"{len(entries)} entries, codec {CODEC}")
+
+    print("Decode / encode:")
+    timed("json.loads", lambda: json.loads(raw), rounds)
+    timed(f"codec.loads ({CODEC})", lambda: loads(raw), rounds)
+    timed("json.dumps indent=2", lambda: json.dumps(entries, ensure_ascii=False, indent=2), rounds)
+    timed(f"codec.dumps ({CODEC})", lambda: dumps(entries), rounds)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with EntryStore(os.path.join(tmp, "bench.db"), legacy_json=None) as store:
+            store.import_json(DATA_FILE)
+            print("Export:")
+            for name in ("export.json", "export.json.gz"):
+                path = os.path.join(tmp, name)
+                timed(name, lambda: store.export_json(path), 1)
+                print(f"    {os.path.getsize(path) / 1024:.0f} KB (data_store.json: {len(raw) / 1024:.0f} KB)")
+            with open(os.path.join(tmp, "export.json"), "rb") as f:
+                exported = {e["id"]: e for e in loads(f.read())}
+            mismatches = sum(1 for entry in entries if exported.get(entry["id"]) != entry)
+            print(f"  {mismatches} JSON → SQLite → JSON mismatches")
+
+if __name__ == "__main__":
+    main()
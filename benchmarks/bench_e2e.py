@@ -0,0 +1,338 @@
+"""Offline end-to-end benchmark: fetch → process → Notion upload against local stand-ins.
+
+Local HTTP servers stand in for the site (CSRF token and diary-list API),
+the media CDN and the Notion API, each with configurable latency and
+injected failures (503 from the site and CDN, 429 from Notion). The diary
+list is rebuilt from data_store.json entries. The run goes through the
+real fetch_all_entries → process_and_save → upload_to_notion path (or
+run_pipeline with --pipeline) in a scratch directory. Translation uses a
+stand-in translator with its own latency, since the Google endpoint
+cannot be served locally in a stable way.
+
+    python benchmarks/bench_e2e.py [--entries 200] [--latency 20] [--error-rate 0.02] [--pipeline] [--reconcile]
+
+With --reconcile the store is then compared with the Notion stand-in (a
+data source query, as with API version 2025-09-03) and matched pages adopted.
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+SITE_ORIGIN = "https://yoasobi-heaven.com"
+CDN_ORIGIN = "https://img.cityheaven.net"
+
+class StandIn(BaseHTTPRequestHandler):
+    """Base handler: latency, failure injection and per-server counters."""
+    protocol_version = "HTTP/1.1" # Keep-alive, so connection pooling is exercised
+    latency = 0.0
+    error_rate = 0.0
+    error_status = 503
+    rng = None
+    stats = None
+    lock = None
+
+    def log_message(self, *args):
+        pass
+
+    def begin(self):
+        """Read the request body and decide whether to fail; returns the body or None."""
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        time.sleep(self.latency)
+        with self.lock:
+            self.stats["requests"] += 1
+            fail = self.rng.random() < self.error_rate
+            if fail:
+                self.stats["errors"] += 1
+        if fail:
+            payload = {"object": "error", "status": self.error_status, "code": "rate_limited",
+                       "message": "Injected failure"}
+            self.send(payload, status=self.error_status, headers={"Retry-After": "0"})
+            return None
+        return body
+
+    def send(self, payload, status=200, headers=None, content_type="application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+            with self.lock:
+                self.stats["bytes"] += len(data)
+
+class SiteHandler(StandIn):
+    pages = []
+
+    def do_GET(self):
+        if self.begin() is None:
+            return
+        if self.path.startswith("/api/csrf-token/"):
+            self.send({"token": "bench-token"})
+        else:
+            self.send({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        body = self.begin()
+        if body is None:
+            return
+        page = json.loads(body or b"{}").get("page", 1)
+        entries = self.pages[page - 1] if 0 < page <= len(self.pages) else []
+        self.send({"success": True, "diaryData": {"diary_pc_page_data": entries}})
+
+class CDNHandler(StandIn):
+    media_size = 64 * 1024
+
+    def do_GET(self):
+        if self.begin() is None:
+            return
+        # Distinct bytes per path, so content deduplication does not hide the transfer
+        seed = hashlib.sha256(self.path.split("?")[0].encode("utf-8")).digest()
+        data = (seed * (self.media_size // len(seed) + 1))[:self.media_size]
+        self.send(data, content_type="application/octet-stream")
+
+    do_HEAD = do_GET
+
+class NotionHandler(StandIn):
+    """Notion API (2025-09-03): pages are created in, and queried through, the database's data source."""
+    error_status = 429
+    page_size = 100
+    pages = None # page id -> properties, as a data source query returns them
+
+    def do_GET(self):
+        if self.begin() is None:
+            return
+        if self.path.startswith("/v1/databases/"):
+            database_id = self.path.split("/")[3]
+            self.send({"object": "database", "id": database_id,
+                       "data_sources": [{"id": f"{database_id}-source", "name": "bench"}]})
+        else:
+            self.send({"object": "error", "status": 404, "code": "object_not_found", "message": "Not found"},
+                      status=404)
+
+    def do_POST(self):
+        body = self.begin()
+        if body is None:
+            return
+        request = json.loads(body or b"{}")
+        if self.path.startswith("/v1/pages"):
+            page_id = str(uuid.uuid4())
+            properties = request.get("properties", {})
+            # Queries return rich text with plain_text filled in
+            for prop in properties.values():
+                for text in prop.get("title", []):
+                    text["plain_text"] = text.get("text", {}).get("content", "")
+            with self.lock:
+                self.pages[page_id] = properties
+            self.send({"object": "page", "id": page_id})
+        elif self.path.startswith("/v1/data_sources/") and self.path.split("?")[0].endswith("/query"):
+            start = int(request.get("start_cursor") or 0)
+            size = min(int(request.get("page_size") or self.page_size), self.page_size)
+            with self.lock:
+                items = list(self.pages.items())
+            results = [{"object": "page", "id": page_id, "properties": properties}
+                       for page_id, properties in items[start:start + size]]
+            more = start + size < len(items)
+            self.send({"object": "list", "results": results, "has_more": more,
+                       "next_cursor": str(start + size) if more else None})
+        else:
+            self.send({"object": "list", "results": [], "has_more": False, "next_cursor": None})
+
+    def do_PATCH(self):
+        if self.begin() is None:
+            return
+        self.send({"object": "list", "results": []})
+
+def start_server(handler, latency, error_rate, seed):
+    stats = {"requests": 0, "errors": 0, "bytes": 0}
+    cls = type(handler.__name__, (handler,), {
+        "latency": latency, "error_rate": error_rate, "rng": random.Random(seed),
+        "stats": stats, "lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", 0), cls)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", stats
+
+def build_pages(count, page_size):
+    """Diary-list pages rebuilt from data_store.json entries (newest first)."""
+    with open(os.path.join(ROOT, "data_store.json"), "r", encoding="utf-8") as f:
+        stored = json.load(f)
+    entries = []
+    for i in range(count):
+        entry = stored[i % len(stored)]
+        diary_id = str(int(entry["id"]) + (i // len(stored)) * 10**9)
+        blocks = entry.get("content_blocks", [])
+        images = [b["url"] for b in blocks if b.get("type") == "image" and b.get("url")]
+        text = (entry.get("original_text") or "").replace("\n", "<br />")
+        item = {
+            "c_diary_id": diary_id,
+            "subject": entry.get("title"),
+            "create_date": entry.get("date"),
+            "girls_image_url": entry.get("image_url_original"),
+            "decoded_body_org": text,
+            "body": text + "".join(f'<img src="{url}">' for url in images),
+        }
+        videos = [b["url"] for b in blocks if b.get("type") == "video" and not b.get("is_cover") and b.get("url")]
+        if videos and "/cs/mvdiary/" in videos[0]:
+            commu_id, member_id, _, movie_file = videos[0].split("/")[-4:]
+            item.update(c_commu_id=commu_id, c_member_id=member_id, movie_filename=movie_file)
+        entries.append(item)
+    return [entries[i:i + page_size] for i in range(0, len(entries), page_size)]
+
+class StandInTranslator:
+    """Translator with GoogleTranslator's interface: one round trip per call, line for line."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def translate(self, text):
+        time.sleep(self.latency)
+        return "\n".join(f"[zh] {line}" if line else line for line in text.split("\n"))
+
+def route(session, site_url, cdn_url):
+    """Send the session's site and CDN traffic to the stand-ins, keeping its retry policy."""
+    from requests.adapters import HTTPAdapter
+
+    base = session.get_adapter(SITE_ORIGIN + "/")
+
+    class Redirect(HTTPAdapter):
+        def __init__(self, origin, target):
+            super().__init__(pool_connections=base._pool_connections, pool_maxsize=base._pool_maxsize,
+                             max_retries=base.max_retries)
+            self.origin, self.target = origin, target
+
+        def send(self, request, **kwargs):
+            request.url = self.target + request.url[len(self.origin):]
+            return super().send(request, **kwargs)
+
+    session.mount(SITE_ORIGIN + "/", Redirect(SITE_ORIGIN, site_url))
+    session.mount(CDN_ORIGIN + "/", Redirect(CDN_ORIGIN, cdn_url))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--entries", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=20, help="ms per request, every stand-in")
+    parser.add_argument("--translate-latency", type=float, default=100, help="ms per translation request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--media-kb", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pipeline", action="store_true", help="run run_pipeline instead of the sequential stages")
+    parser.add_argument("--reconcile", action="store_true", help="then compare the Notion stand-in with the store")
+    parser.add_argument("--verbose", action="store_true", help="show the scraper's own output")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    # Throughput of the code, not of the production rate limits (override via the environment)
+    for key in ("PAGE_RATE", "NOTION_RATE", "TRANSLATION_RATE"):
+        os.environ.setdefault(key, "1000")
+    os.environ.setdefault("NOTION_TOKEN", "bench")
+    os.environ.setdefault("NOTION_DATABASE_ID", "bench-database")
+    os.environ.pop("GITHUB_REPOSITORY", None)
+
+    with open(os.path.join(ROOT, "params.json"), "r") as f:
+        params = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    os.chdir(workdir)
+
+    import scraper
+    import metrics
+    import notion_sync
+    import translation
+    from storage import EntryStore, NOTION_UPLOADED
+    from notion_client import Client
+
+    latency = args.latency / 1000
+    SiteHandler.pages = build_pages(args.entries, args.page_size)
+    CDNHandler.media_size = args.media_kb * 1024
+    NotionHandler.pages = {}
+    servers = {
+        "site": start_server(SiteHandler, latency, args.error_rate, args.seed),
+        "cdn": start_server(CDNHandler, latency, args.error_rate, args.seed + 1),
+        "notion": start_server(NotionHandler, latency, args.error_rate, args.seed + 2),
+    }
+
+    translator = StandInTranslator(args.translate_latency / 1000)
+    translation.get_translator = lambda: translator
+    notion_sync._client = Client(auth="bench", base_url=servers["notion"][1])
+
+    timings = {}
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    with output:
+        session = scraper.get_session()
+        route(session, servers["site"][1], servers["cdn"][1])
+        token = scraper.get_csrf_token(session)
+        store = EntryStore()
+        if args.pipeline:
+            scraper.run_pipeline(session, token, [{"name": "bench", "params": params}], store)
+            timings["pipeline"] = time.perf_counter() - start
+        else:
+            stage_start = time.perf_counter()
+            entries = scraper.fetch_all_entries(session, token, params, store)
+            timings["fetch"] = time.perf_counter() - stage_start
+
+            stage_start = time.perf_counter()
+            processed = scraper.process_and_save(entries, session=session, store=store)
+            store.add_entries(processed)
+            timings["process"] = time.perf_counter() - stage_start
+
+            stage_start = time.perf_counter()
+            page_ids = scraper.upload_to_notion(processed)
+            timings["upload"] = time.perf_counter() - stage_start
+        if args.reconcile:
+            stage_start = time.perf_counter()
+            notion_sync.reconcile_notion(store)
+            timings["reconcile"] = time.perf_counter() - stage_start
+            uploaded = len(store.entries_with_notion_status(NOTION_UPLOADED))
+        saved = len(store)
+        store.close()
+        metrics.write_reports()
+    total = time.perf_counter() - start
+
+    media_bytes = servers["cdn"][2]["bytes"]
+    print(f"{saved} entries in {total:.2f}s: {saved / total:.1f} entries/s, "
+          f"{media_bytes / total / 1024 / 1024:.2f} MB/s media")
+    for stage, elapsed in timings.items():
+        print(f"  {stage:8s} {elapsed:7.2f}s")
+    # Time inside each instrumented stage, summed over its runs (stages overlap in pipeline mode)
+    for hist in metrics.snapshot()["histograms"]:
+        if hist["name"] == "stage_seconds":
+            print(f"    {hist['labels']['stage']:12s} {hist['sum']:7.2f}s over {hist['count']} runs")
+    if not args.pipeline:
+        print(f"  notion pages created: {sum(1 for page_id in page_ids if page_id)}/{len(processed)}")
+    if args.reconcile:
+        print(f"  reconcile: {uploaded}/{saved} entries matched to a page, "
+              f"{len(NotionHandler.pages)} pages in the stand-in database")
+    for name, (server, url, stats) in servers.items():
+        print(f"  {name:8s} {stats['requests']} requests, {stats['errors']} injected failures, "
+              f"{stats['bytes'] / 1024 / 1024:.1f} MB sent")
+        server.shutdown()
+
+    os.chdir(ROOT)
+    if args.keep:
+        print(f"Scratch directory: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
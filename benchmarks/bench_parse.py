@@ -0,0 +1,66 @@
+"""Micro-benchmark: the ordered body parser vs. the old regex cleanup.
+
+Bodies are rebuilt from data_store.json texts (newlines as <br>, a few
+inline images and wrapper tags), then both paths run over all of them.
+
+    python benchmarks/bench_parse.py [rounds]
+"""
+import os
+import re
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from parsing import parse_body, body_text, body_images
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_store.json")
+IMG = '<img src="https://img.cityheaven.net/img/girls/diary/{}.jpg" alt="">'
+
+def build_bodies():
+    with open(DATA_FILE, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    bodies = []
+    for i, entry in enumerate(entries):
+        lines = (entry.get("original_text") or "").split("\n")
+        # An image every ~8 lines, like posts with photos between paragraphs
+        parts = []
+        for n, line in enumerate(lines):
+            parts.append(f'<span style="font-size:14px">{line}</span>')
+            if n % 8 == 7:
+                parts.append(IMG.format(f"{i}_{n}"))
+        bodies.append("<div>" + "<br />".join(parts) + "</div>")
+    return bodies
+
+def regex_path(html):
+    # As process_and_save did it: two passes for text, a third for image sources
+    text = re.sub(r'<br\s*/?>', '\n', html)
+    text = re.sub(r'<[^>]+>', '', text).strip()
+    images = [
+        src for src in re.findall(r'src="([^"]+)"', html)
+        if "cityheaven.net" in src or "yoasobi-heaven" in src
+    ]
+    return text, images
+
+def parser_path(html):
+    runs = parse_body(html)
+    return body_text(runs), body_images(runs)
+
+def bench(func, bodies, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for body in bodies:
+            func(body)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    bodies = build_bodies()
+    mismatches = sum(regex_path(body) != parser_path(body) for body in bodies)
+    size = sum(len(body) for body in bodies)
+    print(f"{len(bodies)} bodies, {size / 1024 / 1024:.1f} MB, {mismatches} output mismatches")
+    for name, func in (("regex", regex_path), ("parser", parser_path)):
+        elapsed = bench(func, bodies, rounds)
+        print(f"  {name:6s} {elapsed * 1000:8.1f} ms  ({len(bodies) / elapsed:,.0f} bodies/s)")
@@ -0,0 +1,95 @@
+"""Startup benchmark: import time of the entry points, from `python -X importtime`.
+
+Each module is imported in a fresh interpreter (best of --rounds), and the
+heaviest imports are listed. Heavy optional stacks (the translator, the
+Notion client, Pillow) should not show up until a stage uses them.
+
+    python benchmarks/bench_startup.py [--rounds 5] [--save baseline.json | --check baseline.json]
+
+With --check the run fails if any entry point got more than --tolerance
+slower than the saved baseline, or started importing a lazy stack.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# What each entry point imports on the way to its first line of work
+TARGETS = ["main", "scraper", "storage", "media", "translation", "notion_sync", "optimize"]
+LAZY = ["deep_translator", "notion_client", "httpx", "PIL", "bs4"]
+
+def import_profile(module):
+    """(total µs for `module`, {module it imported: cumulative µs}) in a fresh interpreter."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    rows = [] # (depth, name, cumulative µs), children listed before their parent
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        if cum.strip().isdigit():
+            rows.append(((len(name) - len(name.lstrip())) // 2, name.strip(), int(cum)))
+    for i, (depth, name, cum) in enumerate(rows):
+        if name == module and depth == 0:
+            children = {}
+            for child_depth, child, child_cum in reversed(rows[:i]):
+                if child_depth <= depth:
+                    break
+                children[child] = child_cum
+            return cum, children
+    return 0, {}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="heaviest imports listed per entry point")
+    parser.add_argument("--save", help="write the results as a baseline")
+    parser.add_argument("--check", help="compare against a baseline and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs. the baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for module in TARGETS:
+        runs = [import_profile(module) for _ in range(args.rounds)]
+        total, cumulative = min(runs, key=lambda run: run[0])
+        lazy = sorted({name.split(".")[0] for name in cumulative} & set(LAZY))
+        results[module] = {"ms": total / 1000, "lazy_loaded": lazy}
+        print(f"{module:12s} {total / 1000:7.1f} ms" + (f"  (loads {', '.join(lazy)})" if lazy else ""))
+        heaviest = sorted(((us, name) for name, us in cumulative.items()), reverse=True)
+        seen = set()
+        for us, name in heaviest:
+            if len(seen) >= args.top:
+                break
+            top = name.split(".")[0]
+            if top in seen:
+                continue
+            seen.add(top)
+            print(f"    {name:30s} {us / 1000:7.1f} ms")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"Baseline saved to {args.save}")
+    if args.check:
+        with open(args.check, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = []
+        for module, result in results.items():
+            before = baseline.get(module)
+            if not before:
+                continue
+            if result["ms"] > before["ms"] * (1 + args.tolerance):
+                failures.append(f"{module}: {before['ms']:.1f} ms -> {result['ms']:.1f} ms")
+            for name in set(result["lazy_loaded"]) - set(before["lazy_loaded"]):
+                failures.append(f"{module}: now imports {name} at startup")
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+        print("No startup regressions.")
+
+if __name__ == "__main__":
+    main()
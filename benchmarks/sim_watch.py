@@ -0,0 +1,83 @@
+"""Simulation: adaptive watch polling vs. fixed schedules, on the stored posting history.
+
+The hour-of-day histogram is built from the older half of data_store.json
+timestamps; the newer half is then replayed as the posts to catch. For each
+schedule it reports polls per day (one list request each, thanks to the
+cursor) and the delay between a post and the poll that sees it.
+
+Every schedule starts `--offset` seconds past an hour, like the watch
+grid (and a cron job, which fires a little after its minute).
+
+    python benchmarks/sim_watch.py [--fastest 300] [--slowest 3600] [--offset 60]
+"""
+import os
+import sys
+import json
+import bisect
+import argparse
+import statistics
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from scraper import JST, WATCH_MIN_INTERVAL, WATCH_MAX_INTERVAL, WATCH_OFFSET, poll_intervals, next_poll_delay
+
+def simulate(posts, start, end, next_delay):
+    """Poll from `start` to `end`; returns (polls, delays in seconds)."""
+    polls = []
+    t = start
+    found = False
+    while t < end:
+        polls.append(t)
+        seen_before = bisect.bisect_right(posts, polls[-2]) if len(polls) > 1 else 0
+        found = bisect.bisect_right(posts, t) > seen_before
+        t += next_delay(t, found)
+    delays = []
+    for post in posts:
+        i = bisect.bisect_left(polls, post)
+        if i < len(polls):
+            delays.append(polls[i] - post)
+    return polls, delays
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--fastest", type=float, default=WATCH_MIN_INTERVAL, help="seconds between polls in the busiest hour")
+    parser.add_argument("--slowest", type=float, default=WATCH_MAX_INTERVAL, help="seconds between polls at most")
+    parser.add_argument("--offset", type=float, default=WATCH_OFFSET, help="seconds past the hour of the first poll")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "data_store.json"), "r", encoding="utf-8") as f:
+        timestamps = sorted(e["timestamp"] for e in json.load(f) if e.get("timestamp"))
+    history, posts = timestamps[:len(timestamps) // 2], timestamps[len(timestamps) // 2:]
+    start, end = posts[0] // 3600 * 3600 + args.offset, posts[-1]
+    days = (end - start) / 86400
+
+    histogram = [0] * 24
+    for ts in history:
+        histogram[datetime.fromtimestamp(ts, JST).hour] += 1
+    intervals = poll_intervals(histogram, args.fastest, args.slowest)
+    print(f"History: {len(history)} posts; replaying {len(posts)} posts over {days:.0f} days")
+    print("Poll interval by JST hour (min): " + " ".join(f"{h}:{i / 60:.0f}" for h, i in enumerate(intervals)))
+
+    def adaptive(t, found):
+        delay = next_poll_delay(intervals, datetime.fromtimestamp(t, JST), args.offset)
+        return min(delay, args.fastest) if found else delay
+
+    schedules = {
+        "every 6 h (cron)": lambda t, found: 6 * 3600,
+        "every 1 h": lambda t, found: 3600,
+        f"every {args.fastest / 60:.0f} min": lambda t, found: args.fastest,
+        "adaptive": adaptive,
+    }
+    # A fixed interval spending the same number of polls as the adaptive schedule
+    budget = len(simulate(posts, start, end, adaptive)[0]) / days
+    schedules[f"same polls, fixed"] = lambda t, found: 86400 / budget
+    print(f"{'schedule':18s} {'polls/day':>10s} {'mean delay':>11s} {'median':>8s} {'p90':>8s}")
+    for name, next_delay in schedules.items():
+        polls, delays = simulate(posts, start, end, next_delay)
+        p90 = statistics.quantiles(delays, n=10)[-1]
+        print(f"{name:18s} {len(polls) / days:10.1f} {statistics.mean(delays) / 60:9.1f} m "
+              f"{statistics.median(delays) / 60:6.1f} m {p90 / 60:6.1f} m")
+
+if __name__ == "__main__":
+    main()
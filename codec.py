@@ -0,0 +1,30 @@
+import json
+
+# orjson is a declared dependency; msgspec, then the standard library, cover environments without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    def dumps(obj):
+        """Compact JSON text (non-ASCII kept as is)."""
+        return orjson.dumps(obj).decode("utf-8")
+    loads = orjson.loads
+elif msgspec is not None:
+    _encoder = msgspec.json.Encoder()
+    def dumps(obj):
+        """Compact JSON text (non-ASCII kept as is)."""
+        return _encoder.encode(obj).decode("utf-8")
+    loads = msgspec.json.decode
+else:
+    def dumps(obj):
+        """Compact JSON text (non-ASCII kept as is)."""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    loads = json.loads
+
+CODEC = "orjson" if orjson is not None else "msgspec" if msgspec is not None else "json"
@@ -0,0 +1,83 @@
+import os
+import json
+import gzip
+import time
+import hashlib
+import threading
+from codec import loads
+
+# HTTP_ARCHIVE=record stores every diary-list response; HTTP_ARCHIVE=replay serves them back offline
+ARCHIVE_MODE = os.environ.get("HTTP_ARCHIVE", "").lower()
+ARCHIVE_DIR = os.environ.get("HTTP_ARCHIVE_DIR", "http_archive")
+
+# Responses of one run go in their own folder: page N of a later run is a different page
+RUN_STAMP = time.strftime("%Y%m%dT%H%M%S")
+
+_replay_pages = {}
+_replay_lock = threading.Lock()
+
+def is_recording():
+    return ARCHIVE_MODE == "record"
+
+def is_replaying():
+    return ARCHIVE_MODE == "replay"
+
+def params_key(params):
+    """Stable key for the request parameters, ignoring the page number."""
+    stable = {k: v for k, v in params.items() if k != "page"}
+    encoded = json.dumps(stable, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+def record_response(params, page, body):
+    """Store one raw diary-list response body (bytes), gzip-compressed."""
+    folder = os.path.join(ARCHIVE_DIR, params_key(params))
+    run_folder = os.path.join(folder, RUN_STAMP)
+    os.makedirs(run_folder, exist_ok=True)
+    params_file = os.path.join(folder, "params.json")
+    if not os.path.exists(params_file):
+        with open(params_file, "w", encoding="utf-8") as f:
+            json.dump({k: v for k, v in params.items() if k != "page"}, f, ensure_ascii=False, indent=1)
+    path = os.path.join(run_folder, f"{page:04d}.json.gz")
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wb", compresslevel=9) as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+def _load_pages(params):
+    """All archived pages for `params`: newest run first, pages in order, entries deduplicated."""
+    folder = os.path.join(ARCHIVE_DIR, params_key(params))
+    if not os.path.isdir(folder):
+        return []
+    merged = []
+    seen = set()
+    page_size = 1
+    runs = sorted((d for d in os.listdir(folder) if os.path.isdir(os.path.join(folder, d))), reverse=True)
+    for run in runs:
+        run_folder = os.path.join(folder, run)
+        for name in sorted(n for n in os.listdir(run_folder) if n.endswith(".json.gz")):
+            try:
+                with gzip.open(os.path.join(run_folder, name), "rb") as f:
+                    data = loads(f.read())
+            except Exception as e:
+                print(f"Error reading archived page {run}/{name}: {e}")
+                continue
+            entries = data.get("diaryData", {}).get("diary_pc_page_data", [])
+            page_size = max(page_size, len(entries))
+            for entry in entries:
+                diary_id = str(entry.get("c_diary_id"))
+                if diary_id not in seen:
+                    seen.add(diary_id)
+                    merged.append(entry)
+    # Re-paginate at the API's page size, so runs that recorded one page each do not replay as tiny pages
+    return [merged[i:i + page_size] for i in range(0, len(merged), page_size)]
+
+def replay_page(params, page):
+    """Entries of archived page `page` (1-based) for `params`; [] past the end."""
+    key = params_key(params)
+    with _replay_lock:
+        if key not in _replay_pages:
+            _replay_pages[key] = _load_pages(params)
+            print(f"Replaying {sum(len(p) for p in _replay_pages[key])} archived entries "
+                  f"in {len(_replay_pages[key])} pages from {ARCHIVE_DIR}/{key}")
+        pages = _replay_pages[key]
+    return pages[page - 1] if 0 < page <= len(pages) else []
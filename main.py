@@ -1,6 +1,198 @@
-def main():
-    print("Hello from yoasobi-scraper!")
+"""Command-line entry point.
 
+    python main.py [run]                 fetch, process and upload new entries (the scheduled job)
+    python main.py fetch                 only store the raw records of new entries
+    python main.py process               process the fetched records (download, translate, save)
+    python main.py upload [--reconcile]  upload entries still pending in Notion
+    python main.py backfill              like run, over every page instead of just the new ones
+    python main.py watch                 keep running, polling on an adaptive schedule
+    python main.py rerender [from] [to]  rebuild stored entries from their raw records
+    python main.py locked [--refetch]    list member-only entries waiting for cookies, or re-fetch them now
+
+Maintenance (media commands take an optional folder, default images/):
+
+    python main.py dedupe                index existing media so new downloads reuse identical files
+    python main.py gc [--dry-run]        delete media no stored entry references
+    python main.py audit                 list stored entries whose media is missing (exit 1 if any)
+    python main.py refresh [--older-than DAYS]  re-check downloaded media with conditional requests
+    python main.py optimize              build web-sized copies of every downloaded image
+    python main.py import <file>         import a data_store.json-style archive (.json or .json.gz)
+    python main.py export <file>         export the store in the data_store.json format
+
+Each command imports only what it uses: the translator and the Notion
+client load when a stage first needs them, so short runs start quickly.
+"""
+import sys
+import atexit
+import argparse
+
+def cmd_run(args, backfill=None):
+    from scraper import load_targets, run_once
+    return 0 if run_once(load_targets(), backfill=backfill) else 1
+
+def cmd_backfill(args):
+    return cmd_run(args, backfill=True)
+
+def cmd_fetch(args):
+    from scraper import load_targets, get_session, get_csrf_token, save_session_cache, fetch_raw
+    from storage import EntryStore
+    targets = load_targets()
+    session = get_session()
+    token = get_csrf_token(session)
+    if not token:
+        return 1
+    with EntryStore() as store:
+        print(f"Fetched {fetch_raw(session, token, targets, store, backfill=args.all or None)} new entries.")
+    save_session_cache(session)
+    return 0
+
+def cmd_process(args):
+    from scraper import process_raw
+    from storage import EntryStore
+    with EntryStore() as store:
+        print(f"Processed {process_raw(store)} entries.")
+    return 0
+
+def cmd_upload(args):
+    from notion_sync import sync_pending, reconcile_notion
+    from storage import EntryStore
+    with EntryStore() as store:
+        if args.reconcile:
+            reconcile_notion(store)
+        else:
+            sync_pending(store)
+    return 0
+
+def cmd_watch(args):
+    from scraper import load_targets, watch
+    watch(load_targets())
+    return 0
+
+def cmd_rerender(args):
+    from scraper import rerender_entries
+    from storage import EntryStore
+    with EntryStore() as store:
+        print(f"Re-rendered {rerender_entries(store, args.id_from, args.id_to)} entries.")
+    return 0
+
+def cmd_locked(args):
+    from storage import EntryStore
+    if args.refetch:
+        from scraper import load_targets, get_session, get_csrf_token, save_session_cache, refetch_locked
+        session = get_session()
+        token = get_csrf_token(session)
+        if not token:
+            return 1
+        with EntryStore() as store:
+            refetch_locked(session, token, load_targets(), store, force=True)
+        save_session_cache(session)
+        return 0
+    from datetime import datetime
+    from scraper import JST
+    with EntryStore() as store:
+        store.queue_stored_placeholders()
+        locked = store.locked_entries()
+    for entry_id, timestamp in sorted(locked.items(), key=lambda item: item[1] or 0, reverse=True):
+        print(f"{entry_id}  {datetime.fromtimestamp(timestamp, JST):%Y-%m-%d %H:%M}" if timestamp else entry_id)
+    print(f"{len(locked)} member-only entries locked.")
+    return 0
+
+def cmd_dedupe(args):
+    from media import IMAGE_DIR, dedupe_folder
+    dedupe_folder(args.folder or IMAGE_DIR)
+    return 0
+
+def cmd_gc(args):
+    from media import IMAGE_DIR, collect_garbage
+    collect_garbage(args.folder or IMAGE_DIR, dry_run=args.dry_run)
+    return 0
+
+def cmd_audit(args):
+    from media import IMAGE_DIR, audit_media
+    return 1 if audit_media(args.folder or IMAGE_DIR) else 0
+
+def cmd_refresh(args):
+    from media import IMAGE_DIR, refresh_media
+    from scraper import BASE_URL
+    older_than = args.older_than and args.older_than * 86400
+    refresh_media(args.folder or IMAGE_DIR, older_than=older_than, referer=BASE_URL)
+    return 0
+
+def cmd_optimize(args):
+    import os
+    from media import IMAGE_DIR, MANIFEST_NAME
+    from optimize import optimize_images
+    folder = args.folder or IMAGE_DIR
+    optimize_images(
+        sorted(f for f in os.listdir(folder) if f != MANIFEST_NAME and os.path.isfile(os.path.join(folder, f))),
+        folder,
+    )
+    return 0
+
+def cmd_import(args):
+    from storage import EntryStore
+    with EntryStore(legacy_json=None) as store:
+        store.import_json(args.file)
+    return 0
+
+def cmd_export(args):
+    from storage import EntryStore
+    with EntryStore(legacy_json=None) as store:
+        store.export_json(args.file)
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape, translate and publish diary entries.")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="fetch, process and upload new entries").set_defaults(func=cmd_run)
+    fetch = commands.add_parser("fetch", help="store the raw records of new entries")
+    fetch.add_argument("--all", action="store_true", help="scan every page (like BACKFILL)")
+    fetch.set_defaults(func=cmd_fetch)
+    commands.add_parser("process", help="process fetched records").set_defaults(func=cmd_process)
+    upload = commands.add_parser("upload", help="upload pending entries to Notion")
+    upload.add_argument("--reconcile", action="store_true", help="compare the whole database with the store")
+    upload.set_defaults(func=cmd_upload)
+    commands.add_parser("backfill", help="run over every page").set_defaults(func=cmd_backfill)
+    commands.add_parser("watch", help="poll on an adaptive schedule").set_defaults(func=cmd_watch)
+    rerender = commands.add_parser("rerender", help="rebuild stored entries from their raw records")
+    rerender.add_argument("id_from", nargs="?")
+    rerender.add_argument("id_to", nargs="?")
+    rerender.set_defaults(func=cmd_rerender)
+    locked = commands.add_parser("locked", help="member-only entries waiting for valid cookies")
+    locked.add_argument("--refetch", action="store_true", help="re-fetch them now with the current cookies")
+    locked.set_defaults(func=cmd_locked)
+
+    # Maintenance; the offline commands leave the last run's report alone
+    dedupe = commands.add_parser("dedupe", help="index existing media so new downloads reuse identical files")
+    dedupe.add_argument("folder", nargs="?")
+    dedupe.set_defaults(func=cmd_dedupe, reports=False)
+    gc = commands.add_parser("gc", help="delete media no stored entry references")
+    gc.add_argument("folder", nargs="?")
+    gc.add_argument("--dry-run", action="store_true", help="only list what would be removed")
+    gc.set_defaults(func=cmd_gc, reports=False)
+    audit = commands.add_parser("audit", help="list stored entries whose media is missing")
+    audit.add_argument("folder", nargs="?")
+    audit.set_defaults(func=cmd_audit, reports=False)
+    refresh = commands.add_parser("refresh", help="re-check downloaded media with conditional requests")
+    refresh.add_argument("folder", nargs="?")
+    refresh.add_argument("--older-than", type=float, metavar="DAYS", help="only URLs not checked for this many days")
+    refresh.set_defaults(func=cmd_refresh)
+    optimize = commands.add_parser("optimize", help="build web-sized copies of every downloaded image")
+    optimize.add_argument("folder", nargs="?")
+    optimize.set_defaults(func=cmd_optimize)
+    import_json = commands.add_parser("import", help="import a data_store.json-style archive")
+    import_json.add_argument("file", help=".json or .json.gz")
+    import_json.set_defaults(func=cmd_import, reports=False)
+    export_json = commands.add_parser("export", help="export the store in the data_store.json format")
+    export_json.add_argument("file", help=".json, or .json.gz to compress")
+    export_json.set_defaults(func=cmd_export, reports=False)
+    args = parser.parse_args(argv)
+
+    if getattr(args, "reports", True):
+        # JSON run report and Prometheus textfile, written however the run ends
+        from metrics import write_reports
+        atexit.register(write_reports)
+    return (args.func if args.command else cmd_run)(args)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
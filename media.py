@@ -0,0 +1,535 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from urllib.parse import urlparse
+from transport import get_default_session
+from metrics import inc
+from storage import EntryStore
+
+IMAGE_DIR = "images"
+
+# Content-addressed index of the media folder, committed together with it
+MANIFEST_NAME = "manifest.json"
+
+# Per-host cap for concurrent media downloads (img.cityheaven.net serves almost everything)
+MAX_DOWNLOADS_PER_HOST = int(os.environ.get("DOWNLOAD_CONCURRENCY", "4"))
+
+# Read/write buffer for streamed downloads
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+DOWNLOAD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+}
+
+_manifests = {}
+_manifest_lock = threading.RLock()
+
+class MediaManifest:
+    """URL → content hash → stored file index for one media folder.
+
+    Each distinct blob (by SHA-256 of its bytes) is stored once, under the
+    first filename it was seen with. Every other URL or filename carrying
+    the same bytes resolves to that stored file. Blobs also list the ids
+    of the entries that reference them, so unused files can be found.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.blobs = {}  # sha256 -> {"filename": stored file, "size": bytes, "entries": referencing ids}
+        self.urls = {}   # source URL -> sha256
+        self.files = {}  # any filename seen (stored or alias) -> sha256
+        self.validators = {}  # source URL -> {"etag", "last_modified", "checked"} for conditional refreshes
+        self.derivatives = {}  # sha256 -> {"filename": web-sized copy or None, "settings": ...}
+        self.dirty = False
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.blobs = data.get("blobs", {})
+                self.urls = data.get("urls", {})
+                self.files = data.get("files", {})
+                self.validators = data.get("validators", {})
+                self.derivatives = data.get("derivatives", {})
+            except Exception as e:
+                print(f"Error loading media manifest: {e}")
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "blobs": self.blobs, "urls": self.urls, "files": self.files, "validators": self.validators,
+                "derivatives": self.derivatives,
+            }, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def stored_filename(self, digest):
+        """Filename holding the blob, if it is still on disk."""
+        blob = self.blobs.get(digest)
+        if blob and os.path.exists(os.path.join(self.folder, blob["filename"])):
+            return blob["filename"]
+        return None
+
+    def add(self, digest, filename, size, url=None):
+        """Register bytes seen as `filename`; returns the file that stores them."""
+        if not self.stored_filename(digest):
+            self.blobs[digest] = {"filename": filename, "size": size}
+        self.files[filename] = digest
+        if url:
+            self.urls[url] = digest
+        self.dirty = True
+        return self.blobs[digest]["filename"]
+
+    def drop_file(self, filename):
+        """Forget blobs stored as `filename`, before its bytes are overwritten."""
+        for digest, blob in list(self.blobs.items()):
+            if blob["filename"] == filename:
+                del self.blobs[digest]
+                self.dirty = True
+
+    def add_refs(self, filename, entry_ids):
+        """Record that `entry_ids` reference the blob behind `filename`."""
+        blob = self.blobs.get(self.files.get(filename))
+        if blob is None:
+            return
+        known = blob.get("entries", [])
+        merged = sorted(set(known).union(str(i) for i in entry_ids))
+        if merged != known:
+            blob["entries"] = merged
+            self.dirty = True
+
+    def forget(self, digest):
+        """Drop a blob together with its aliases, source URLs and derivative."""
+        self.blobs.pop(digest, None)
+        self.derivatives.pop(digest, None)
+        for name in [n for n, d in self.files.items() if d == digest]:
+            del self.files[name]
+        for url in [u for u, d in self.urls.items() if d == digest]:
+            del self.urls[url]
+            self.validators.pop(url, None)
+        self.dirty = True
+
+    def lookup_url(self, url):
+        digest = self.urls.get(url)
+        return self.stored_filename(digest) if digest else None
+
+    def resolve(self, filename):
+        """Map any known filename (including deduplicated aliases) to the stored file."""
+        digest = self.files.get(filename)
+        return (self.stored_filename(digest) if digest else None) or filename
+
+    def derivative(self, filename):
+        """Web-sized copy of `filename` (relative to the folder), if one exists on disk."""
+        digest = self.files.get(filename)
+        web = (self.derivatives.get(digest) or {}).get("filename") if digest else None
+        if web and os.path.exists(os.path.join(self.folder, web)):
+            return web
+        return None
+
+def get_manifest(folder=IMAGE_DIR):
+    with _manifest_lock:
+        if folder not in _manifests:
+            _manifests[folder] = MediaManifest(folder)
+        return _manifests[folder]
+
+def save_manifest(folder=IMAGE_DIR):
+    with _manifest_lock:
+        get_manifest(folder).save()
+
+def resolve_filename(filename, folder=IMAGE_DIR):
+    """Return the stored file for `filename`, following the manifest for deduplicated copies."""
+    if not filename:
+        return filename
+    with _manifest_lock:
+        return get_manifest(folder).resolve(filename)
+
+def derivative_filename(filename, folder=IMAGE_DIR):
+    """Return the web-sized copy of `filename`, or None if it has none (see optimize.py)."""
+    if not filename:
+        return None
+    with _manifest_lock:
+        manifest = get_manifest(folder)
+        return manifest.derivative(manifest.resolve(filename))
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _expected_size(response):
+    """Full size of the resource from Content-Range/Content-Length, if it can be trusted."""
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        return None # iter_content yields decoded bytes, which will not match
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    length = response.headers.get("Content-Length")
+    return int(length) if length and response.status_code == 200 else None
+
+def _is_complete(filepath, url, requester, headers):
+    """Check a file from before the manifest against the server's Content-Length."""
+    try:
+        r = requester.head(url, headers=headers, allow_redirects=True)
+        expected = _expected_size(r) if r.status_code == 200 else None
+    except Exception:
+        expected = None
+    return expected is None or os.path.getsize(filepath) == expected
+
+def _local_filename(manifest, url):
+    """Name to store `url` under: its basename, unless the manifest has that name for another URL's bytes.
+
+    A colliding URL (e.g. a query-string variant) gets a suffix from its own
+    hash, so the name is the same on every run and a partial download resumes.
+    """
+    filename = os.path.basename(url.split("?")[0]) # Handle query params
+    digest = manifest.files.get(filename)
+    if digest is None or digest == manifest.urls.get(url):
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}-{hashlib.sha256(url.encode('utf-8')).hexdigest()[:8]}{ext}"
+
+def _download(url, folder, session, referer, refresh=False):
+    """download_file without persisting the manifest (see download_file)."""
+    if not url:
+        return None
+
+    try:
+        # Create folder if not exists
+        os.makedirs(folder, exist_ok=True)
+        manifest = get_manifest(folder)
+
+        with _manifest_lock:
+            filename = _local_filename(manifest, url)
+        filepath = os.path.join(folder, filename)
+        tmp_path = f"{filepath}.part"
+
+        # Download with anti-hotlinking protection
+        headers = dict(DOWNLOAD_HEADERS)
+
+        # Add referer if provided (important for anti-hotlinking)
+        if referer:
+            headers["Referer"] = referer
+
+        # Use session if provided, otherwise the shared pooled session
+        requester = session if session else get_default_session()
+
+        # Already have these bytes from this URL, possibly under another name
+        with _manifest_lock:
+            known = manifest.lookup_url(url)
+            validators = manifest.validators.get(url, {})
+        if known and not refresh:
+            inc("media_files_total", result="cached")
+            return known
+
+        if known:
+            # Refresh: let the server answer 304 if nothing changed
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        elif os.path.exists(filepath) and filename not in manifest.files:
+            # Files from before the manifest existed may be truncated: verify, then index or resume
+            if _is_complete(filepath, url, requester, headers):
+                digest = file_digest(filepath)
+                with _manifest_lock:
+                    return manifest.add(digest, filename, os.path.getsize(filepath), url)
+            print(f"Resuming truncated file: {filename}")
+            os.replace(filepath, tmp_path)
+
+        offset = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        r = requester.get(url, headers=headers, stream=True)
+
+        if r.status_code == 304:
+            print(f"Not modified: {filename}")
+            inc("media_files_total", result="not_modified")
+            with _manifest_lock:
+                manifest.validators.setdefault(url, {})["checked"] = time.time()
+                manifest.dirty = True
+            return known
+        if r.status_code == 416 and offset:
+            # Partial file no longer matches the resource; start over
+            os.remove(tmp_path)
+            return _download(url, folder, session, referer, refresh)
+        if r.status_code not in (200, 206):
+            print(f"Failed to download {url}: {r.status_code}")
+            inc("media_files_total", result="failed")
+            return None
+
+        # Hash while streaming into the temp file, then keep it only if the bytes are new
+        h = hashlib.sha256()
+        if r.status_code == 206 and r.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+            with open(tmp_path, "rb") as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    h.update(chunk)
+            mode, size = "ab", offset
+        else:
+            mode, size = "wb", 0
+        expected = _expected_size(r)
+
+        with open(tmp_path, mode) as f:
+            for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                h.update(chunk)
+                size += len(chunk)
+        inc("media_bytes_downloaded_total", size - (offset if mode == "ab" else 0))
+
+        if expected is not None and size != expected:
+            print(f"Incomplete download {url}: {size} of {expected} bytes (kept for resume)")
+            return None
+
+        digest = h.hexdigest()
+        with _manifest_lock:
+            stored = manifest.stored_filename(digest)
+            if stored:
+                os.remove(tmp_path)
+                print(f"Downloaded: {filename} (duplicate of {stored})")
+                inc("media_files_total", result="duplicate")
+            else:
+                old = manifest.files.get(filename)
+                if old and any(d == old and u != url for u, d in manifest.urls.items()):
+                    # A refresh changed bytes that other URLs still share: keep them, store these apart
+                    stem, ext = os.path.splitext(filename)
+                    filename = f"{stem}-{digest[:8]}{ext}"
+                    filepath = os.path.join(folder, filename)
+                manifest.drop_file(filename) # A refresh may replace the bytes behind this name
+                os.replace(tmp_path, filepath)
+                print(f"Downloaded: {filename}")
+                inc("media_files_total", result="downloaded")
+            manifest.validators[url] = {
+                key: value for key, value in (
+                    ("etag", r.headers.get("ETag")),
+                    ("last_modified", r.headers.get("Last-Modified")),
+                    ("checked", time.time()),
+                ) if value
+            }
+            return manifest.add(digest, filename, size, url)
+    except Exception as e:
+        print(f"Error downloading {url}: {e}")
+        inc("media_files_total", result="failed")
+        return None
+
+def download_file(url, folder=IMAGE_DIR, session=None, referer=None, refresh=False, entry_id=None):
+    """Download file and return filename if successful.
+
+    Files are deduplicated by content: if the bytes already exist in
+    `folder` under another name, nothing new is written and the existing
+    filename is returned. Data is streamed into `<name>.part` and only
+    renamed into place once it matches the server's size; an interrupted
+    download is resumed with an HTTP Range request on the next attempt.
+
+    Args:
+        url: URL of the file to download
+        folder: Destination folder
+        session: Optional requests.Session for reusing cookies/headers
+        referer: Optional referer URL to bypass anti-hotlinking
+        refresh: Re-check a known URL with a conditional request
+        entry_id: Optional id of the entry using the file, recorded in the manifest
+    """
+    filename = _download(url, folder, session, referer, refresh)
+    if filename and entry_id is not None:
+        with _manifest_lock:
+            get_manifest(folder).add_refs(filename, [entry_id])
+    save_manifest(folder)
+    return filename
+
+async def _download_all(urls, folder, session, referer, per_host, refresh):
+    """Run _download for every URL, at most `per_host` at a time per host."""
+    host_limits = {}
+    # Two URLs can share a basename (e.g. query-string variants): one at a time, so the second sees
+    # the first in the manifest and gets its own name (_local_filename)
+    file_locks = {}
+
+    async def fetch(url):
+        host = urlparse(url).netloc
+        limit = host_limits.setdefault(host, asyncio.Semaphore(per_host))
+        lock = file_locks.setdefault(os.path.basename(url.split("?")[0]), asyncio.Lock())
+        async with lock, limit:
+            filename = await asyncio.to_thread(_download, url, folder, session, referer, refresh)
+        return url, filename
+
+    results = await asyncio.gather(*(fetch(url) for url in urls))
+    return dict(results)
+
+def download_files(urls, folder=IMAGE_DIR, session=None, referer=None, per_host=None, refresh=False, refs=None):
+    """Download many files concurrently.
+
+    Returns a dict mapping each URL to the same filename-or-None result
+    download_file would have returned for it. Duplicate and empty URLs are
+    collapsed, so callers can pass the raw media list of a whole batch.
+    `refs` optionally maps URLs to the ids of the entries using them, which
+    are recorded in the manifest.
+    """
+    unique_urls = list(dict.fromkeys(url for url in urls if url))
+    if not unique_urls:
+        return {}
+    per_host = max(1, per_host or MAX_DOWNLOADS_PER_HOST)
+    print(f"Downloading {len(unique_urls)} media files ({per_host} per host)...")
+    results = asyncio.run(_download_all(unique_urls, folder, session, referer, per_host, refresh))
+    if refs:
+        with _manifest_lock:
+            manifest = get_manifest(folder)
+            for url, filename in results.items():
+                if filename and refs.get(url):
+                    manifest.add_refs(filename, refs[url])
+    save_manifest(folder)
+    return results
+
+def refresh_media(folder=IMAGE_DIR, older_than=None, session=None, referer=None):
+    """Re-check known media URLs with conditional requests, replacing files that changed.
+
+    The server answers 304 for unchanged files (ETag / Last-Modified from
+    the last download), so only changed ones are transferred. With
+    `older_than` (seconds), URLs checked more recently are skipped.
+    Returns {url: filename or None} like download_files.
+    """
+    with _manifest_lock:
+        manifest = get_manifest(folder)
+        cutoff = time.time() - older_than if older_than else None
+        urls = [
+            url for url in manifest.urls
+            if cutoff is None or manifest.validators.get(url, {}).get("checked", 0) < cutoff
+        ]
+    if not urls:
+        print("No media URLs due for a refresh.")
+        return {}
+    return download_files(urls, folder, session=session, referer=referer, refresh=True)
+
+def dedupe_folder(folder=IMAGE_DIR):
+    """Index every file in `folder` so later downloads of the same bytes are deduplicated.
+
+    Byte-identical copies already on disk are recorded as aliases of the
+    first one but kept: published Notion pages link to them by name. Returns
+    the bytes those copies occupy.
+    """
+    manifest = get_manifest(folder)
+    duplicated = 0
+    copies = 0
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder, filename)
+        if filename == MANIFEST_NAME or not os.path.isfile(path):
+            continue
+        digest = file_digest(path)
+        size = os.path.getsize(path)
+        stored = manifest.add(digest, filename, size)
+        if stored != filename:
+            duplicated += size
+            copies += 1
+    manifest.save()
+    print(f"Indexed {folder}/: {copies} existing duplicates ({duplicated / 1024 / 1024:.1f} MB) kept, "
+          f"new downloads of the same bytes will reuse the stored file")
+    return duplicated
+
+def _sync_refs(manifest, refs):
+    """Rewrite every blob's entry list from `refs`; returns the files they keep alive.
+
+    `refs` maps filenames (as stored in entries) to entry ids. The kept set
+    holds those names, the stored files they resolve to and their web copies.
+    """
+    keep = set()
+    by_digest = {}
+    for filename, entry_ids in refs.items():
+        stored = manifest.resolve(filename)
+        keep.update((filename, stored))
+        digest = manifest.files.get(stored)
+        if digest:
+            by_digest.setdefault(digest, set()).update(entry_ids)
+            web = (manifest.derivatives.get(digest) or {}).get("filename")
+            if web:
+                keep.add(web)
+    for digest, blob in manifest.blobs.items():
+        entries = sorted(by_digest.get(digest, ()))
+        if blob.get("entries", []) != entries:
+            blob["entries"] = entries
+            manifest.dirty = True
+    return keep
+
+def collect_garbage(folder=IMAGE_DIR, store=None, dry_run=False):
+    """Delete media files that no stored entry references.
+
+    References come from the entry store (covers, content blocks and their
+    web-sized copies), followed through deduplicated aliases; the manifest's
+    per-blob entry lists are rewritten from them on the way. Partial
+    downloads (*.part) are left for resuming. Returns the bytes reclaimed.
+    """
+    if store is None:
+        with EntryStore() as default_store:
+            return collect_garbage(folder, default_store, dry_run)
+    refs = store.referenced_files()
+    if not refs:
+        print("No stored entry references any media; refusing to delete everything.")
+        return 0
+    with _manifest_lock:
+        manifest = get_manifest(folder)
+        keep = _sync_refs(manifest, refs)
+
+    reclaimed = 0
+    removed = 0
+    for root, _, names in os.walk(folder):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, folder).replace(os.sep, "/")
+            if rel == MANIFEST_NAME or rel in keep or name.endswith((".part", ".tmp")):
+                continue
+            size = os.path.getsize(path)
+            reclaimed += size
+            removed += 1
+            if dry_run:
+                print(f"Would remove {rel} ({size / 1024:.0f} KB)")
+                continue
+            os.remove(path)
+            print(f"Removed {rel} ({size / 1024:.0f} KB)")
+            with _manifest_lock:
+                digest = manifest.files.get(rel)
+                if digest and (manifest.blobs.get(digest) or {}).get("filename") == rel:
+                    manifest.forget(digest)
+                for digest, web in list(manifest.derivatives.items()):
+                    if web.get("filename") == rel:
+                        del manifest.derivatives[digest] # Rebuilt by optimize.py if needed again
+                        manifest.dirty = True
+    if not dry_run:
+        save_manifest(folder)
+    verb = "Would reclaim" if dry_run else "Reclaimed"
+    print(f"{verb} {reclaimed / 1024 / 1024:.1f} MB from {removed} unreferenced files in {folder}/")
+    return reclaimed
+
+def audit_media(folder=IMAGE_DIR, store=None):
+    """Find stored entries whose media is missing from `folder`.
+
+    Returns {entry id: [missing filenames]}.
+    """
+    if store is None:
+        with EntryStore() as default_store:
+            return audit_media(folder, default_store)
+    refs = store.referenced_files()
+    missing = {}
+    with _manifest_lock:
+        manifest = get_manifest(folder)
+        for filename, entry_ids in refs.items():
+            if not os.path.isfile(os.path.join(folder, manifest.resolve(filename))):
+                for entry_id in entry_ids:
+                    missing.setdefault(entry_id, []).append(filename)
+    for entry_id in sorted(missing):
+        print(f"Entry {entry_id}: missing {', '.join(sorted(missing[entry_id]))}")
+    print(f"{len(refs)} files referenced, {len(missing)} entries with missing media "
+          f"({sum(len(files) for files in missing.values())} references)")
+    return missing
+
+if __name__ == "__main__":
+    # Kept for existing jobs: the commands live in main.py (python media.py dedupe|gc|audit|refresh ... still works)
+    from main import main
+    sys.exit(main())
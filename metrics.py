@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextlib
+
+# Written at the end of every scraper run
+METRICS_REPORT_FILE = os.environ.get("METRICS_REPORT", "metrics_report.json")
+METRICS_TEXTFILE = os.environ.get("METRICS_TEXTFILE", "metrics.prom")
+METRICS_PREFIX = "yoasobi_scraper_"
+
+# Opt-in profiling of named stages, e.g. PROFILE_STAGES=process,translate
+PROFILE_STAGES = {s.strip() for s in os.environ.get("PROFILE_STAGES", "").split(",") if s.strip()}
+TRACEMALLOC_STAGES = {s.strip() for s in os.environ.get("TRACEMALLOC_STAGES", "").split(",") if s.strip()}
+
+# Histogram buckets in seconds, from one HTTP round trip up to a whole stage
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_lock = threading.Lock()
+_counters = {}   # (name, labels) -> value
+_histograms = {} # (name, labels) -> {"count", "sum", "max", "buckets"}
+_profilers = {}  # stage -> cProfile.Profile, accumulated over every run of the stage
+_allocations = {} # stage -> peak traced memory and top allocation sites of its last run
+_started = time.time()
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name, value=1, **labels):
+    """Add `value` to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, **labels):
+    """Record one sample (e.g. seconds) in a histogram."""
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)}
+        hist["count"] += 1
+        hist["sum"] += value
+        hist["max"] = max(hist["max"], value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist["buckets"][i] += 1
+                break
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a block as stage `name` (stage_seconds histogram).
+
+    Stages listed in PROFILE_STAGES run under cProfile (results saved as
+    profile_<stage>.prof when the report is written), and stages in
+    TRACEMALLOC_STAGES record their peak traced memory and top allocation
+    sites. cProfile only sees the thread that entered the stage.
+    """
+    profiler = None
+    if name in PROFILE_STAGES:
+        with _lock:
+            profiler = _profilers.setdefault(name, cProfile.Profile())
+        try:
+            profiler.enable()
+        except ValueError: # Another profiler is already active (nested profiled stage)
+            profiler = None
+    trace = name in TRACEMALLOC_STAGES
+    if trace:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+            with _lock:
+                _allocations[name] = {
+                    "peak_bytes": peak,
+                    "top": [{"site": str(stat.traceback), "bytes": stat.size} for stat in top],
+                }
+        observe("stage_seconds", elapsed, stage=name)
+
+def snapshot():
+    """Everything recorded so far, as plain data."""
+    with _lock:
+        return {
+            "started": _started,
+            "duration": time.time() - _started,
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(_counters.items())
+            ],
+            "histograms": [
+                {"name": name, "labels": dict(labels), **hist, "bucket_bounds": list(BUCKETS)}
+                for (name, labels), hist in sorted(_histograms.items())
+            ],
+            "allocations": dict(_allocations),
+        }
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prometheus_text():
+    """The metrics in the Prometheus text exposition format."""
+    lines = []
+    typed = set()
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, dict(v, buckets=list(v["buckets"]))) for k, v in _histograms.items())
+    for (name, labels), value in counters:
+        metric = METRICS_PREFIX + name
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} counter")
+            typed.add(metric)
+        lines.append(f"{metric}{_labels_text(labels)} {value}")
+    for (name, labels), hist in histograms:
+        metric = METRICS_PREFIX + name
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} histogram")
+            typed.add(metric)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, hist["buckets"]):
+            cumulative += count
+            lines.append(f"{metric}_bucket{_labels_text(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{metric}_bucket{_labels_text(labels, [('le', '+Inf')])} {hist['count']}")
+        lines.append(f"{metric}_sum{_labels_text(labels)} {hist['sum']}")
+        lines.append(f"{metric}_count{_labels_text(labels)} {hist['count']}")
+    lines.append(f"# TYPE {METRICS_PREFIX}run_duration_seconds gauge")
+    lines.append(f"{METRICS_PREFIX}run_duration_seconds {time.time() - _started}")
+    lines.append(f"# TYPE {METRICS_PREFIX}last_run_timestamp_seconds gauge")
+    lines.append(f"{METRICS_PREFIX}last_run_timestamp_seconds {time.time()}")
+    return "\n".join(lines) + "\n"
+
+def _write(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path) # Textfile collectors must never see a half-written file
+
+def write_reports():
+    """Write the JSON run report, the Prometheus textfile and any stage profiles."""
+    try:
+        _write(METRICS_REPORT_FILE, json.dumps(snapshot(), ensure_ascii=False, indent=1))
+        _write(METRICS_TEXTFILE, prometheus_text())
+        print(f"Metrics written to {METRICS_REPORT_FILE} and {METRICS_TEXTFILE}")
+    except Exception as e:
+        print(f"Error writing metrics: {e}")
+    with _lock:
+        profilers = dict(_profilers)
+    for name, profiler in profilers.items():
+        path = f"profile_{name}.prof"
+        profiler.dump_stats(path)
+        print(f"Profile of stage '{name}' saved to {path}; top functions by cumulative time:")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
@@ -0,0 +1,431 @@
+import os
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from media import IMAGE_DIR, resolve_filename, derivative_filename
+from ratelimit import TokenBucket, backoff_delay
+from metrics import inc
+from storage import NOTION_PENDING, NOTION_UPLOADED, NOTION_FAILED, NOTION_PARTIAL, NOTION_UNCONFIRMED
+
+# Notion allows an average of 3 requests per second per integration
+NOTION_RATE = float(os.environ.get("NOTION_RATE", "3"))
+NOTION_WORKERS = int(os.environ.get("NOTION_WORKERS", "3"))
+NOTION_MAX_RETRIES = 5
+# Children per request for pages.create / blocks.children.append
+NOTION_MAX_CHILDREN = 100
+
+_rate_limiter = TokenBucket(NOTION_RATE, name="notion")
+_client = None
+
+def get_notion_client():
+    """Return the shared Notion client, or None if credentials are not configured."""
+    global _client
+    token = os.environ.get("NOTION_TOKEN")
+    if not token or not os.environ.get("NOTION_DATABASE_ID"):
+        return None
+    if _client is None:
+        # Imported on first use: notion_client (and httpx) is slow to load
+        from notion_client import Client
+        _client = Client(auth=token)
+    return _client
+
+def notion_call(method, idempotent=True, **kwargs):
+    """Call a Notion API method within the rate limit, retrying 429/5xx responses.
+
+    Retry-After is honoured when Notion sends it; otherwise the wait is an
+    exponential backoff with jitter. Requests that create something pass
+    `idempotent=False`: only 429s, which Notion rejects before doing
+    anything, are retried, since a timed-out or 5xx create may have
+    succeeded and a retry would create it twice.
+    """
+    from notion_client.errors import HTTPResponseError, RequestTimeoutError
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        _rate_limiter.acquire()
+        inc("notion_requests_total")
+        try:
+            return method(**kwargs)
+        except (HTTPResponseError, RequestTimeoutError) as e:
+            status = getattr(e, "status", None)
+            retryable = status == 429 or (idempotent and (isinstance(e, RequestTimeoutError) or (status or 0) >= 500))
+            if not retryable or attempt == NOTION_MAX_RETRIES:
+                raise
+            try:
+                delay = float(getattr(e, "headers", {}).get("Retry-After"))
+            except (TypeError, ValueError):
+                delay = backoff_delay(attempt)
+            print(f"Notion API {status or 'timeout'}, retrying in {delay:.1f}s...")
+            inc("notion_retries_total", status=status or "timeout")
+            time.sleep(delay)
+
+# Construct GitHub raw URL for images
+def get_gh_url(filename):
+    github_repo = os.environ.get("GITHUB_REPOSITORY")
+    if github_repo:
+        # Deduplicated copies resolve to the file that actually holds the bytes,
+        # and images with a web-sized copy are served from that
+        filename = derivative_filename(filename) or resolve_filename(filename)
+        return f"https://raw.githubusercontent.com/{github_repo}/main/{IMAGE_DIR}/{filename}"
+    return None
+
+def build_children(entry):
+    """Prepare Block Children (The Page Content)."""
+    children_blocks = []
+
+    for block in entry.get("content_blocks", []):
+        b_type = block.get('type')
+
+        if b_type == 'heading_2':
+            children_blocks.append({
+                "object": "block",
+                "type": "heading_2",
+                "heading_2": {
+                    "rich_text": [{"type": "text", "text": {"content": block['content']}}]
+                }
+            })
+        elif b_type == 'divider':
+            children_blocks.append({
+                "object": "block",
+                "type": "divider",
+                "divider": {}
+            })
+        elif b_type == 'text':
+            for line in block['content'].split('\n'):
+                if line.strip():
+                    children_blocks.append({
+                        "object": "block",
+                        "type": "paragraph",
+                        "paragraph": {
+                            "rich_text": [{"type": "text", "text": {"content": line[:2000]}}]
+                        }
+                    })
+        elif b_type == 'image':
+            img_gh_url = get_gh_url(block['filename']) or block['url']
+            children_blocks.append({
+                "object": "block",
+                "type": "image",
+                "image": {
+                    "type": "external",
+                    "external": {"url": img_gh_url}
+                }
+            })
+        elif b_type == 'video':
+            # Use GitHub URL if filename exists
+            vid_src = block.get('url')
+            if block.get('filename'):
+                vid_src = get_gh_url(block['filename']) or vid_src
+
+            children_blocks.append({
+                "object": "block",
+                "type": "video",
+                "video": {
+                    "type": "external",
+                    "external": {"url": vid_src}
+                }
+            })
+
+    return children_blocks
+
+def build_properties(entry):
+    """Database properties for an entry's page."""
+    # Handle video vs image cover
+    # If cover is a video, we've already added it to content_blocks at the top
+    # For the Image property, we'll use the first image from content or None
+
+    cover_type = entry.get('cover_type', 'image')
+    cover_filename = entry.get('cover_filename')
+
+    # Prepare Image property
+    image_property = None
+    if cover_type == 'image' and cover_filename:
+        # Normal image cover
+        cover_gh_url = get_gh_url(cover_filename) or entry.get('image_url_original')
+        if cover_gh_url:
+            image_property = {
+                "files": [
+                    {
+                        "name": cover_filename,
+                        "type": "external",
+                        "external": {"url": cover_gh_url}
+                    }
+                ]
+            }
+    else:
+        # Cover is video or missing, try to find first image from content
+        for block in entry.get('content_blocks', []):
+            if block.get('type') == 'image' and block.get('filename'):
+                img_gh_url = get_gh_url(block['filename']) or block.get('url')
+                if img_gh_url:
+                    image_property = {
+                        "files": [
+                            {
+                                "name": block['filename'],
+                                "type": "external",
+                                "external": {"url": img_gh_url}
+                            }
+                        ]
+                    }
+                    break
+
+    # Build properties
+    properties = {
+        "Date": {"date": {"start": datetime.fromtimestamp(entry["timestamp"]).isoformat()}},
+        "Title": {"title": [{"text": {"content": entry["title"]}}]},
+        "Content (JP)": {"rich_text": [{"text": {"content": entry["original_text"][:2000]}}]},
+        "Content (CN)": {"rich_text": [{"text": {"content": entry["translated_text"][:2000]}}]},
+        "Original URL": {"url": entry.get("image_url_original", "")},
+    }
+
+    # Add Image property if we have one
+    if image_property:
+        properties["Image"] = image_property
+
+    return properties
+
+def create_page(client, database_id, entry, on_created=None):
+    """Create the entry's page and return its id.
+
+    Notion accepts at most 100 children per request, so the page is created
+    with the first 100 blocks and the rest are appended in further batches.
+    `on_created(page_id)` is called as soon as the page exists, before the
+    appends, so a failure there still leaves the page id behind.
+    """
+    children_blocks = build_children(entry)
+    page = notion_call(
+        client.pages.create,
+        idempotent=False,
+        parent={"database_id": database_id},
+        properties=build_properties(entry),
+        children=children_blocks[:NOTION_MAX_CHILDREN]
+    )
+    if on_created:
+        on_created(page["id"])
+    for start in range(NOTION_MAX_CHILDREN, len(children_blocks), NOTION_MAX_CHILDREN):
+        notion_call(
+            client.blocks.children.append,
+            idempotent=False, # A repeated append would duplicate the blocks
+            block_id=page["id"],
+            children=children_blocks[start:start + NOTION_MAX_CHILDREN]
+        )
+    return page["id"]
+
+def archive_page(page_id):
+    """Move a page to the Notion trash; returns False if it could not be archived."""
+    client = get_notion_client()
+    if client is None:
+        return False
+    try:
+        notion_call(client.pages.update, page_id=page_id, archived=True)
+    except Exception as e:
+        print(f"Failed to archive Notion page {page_id}: {e}")
+        return False
+    inc("notion_pages_total", result="archived")
+    return True
+
+def is_unconfirmed(error):
+    """True if a failed create may still have happened on Notion's side (timeout, 5xx, lost connection)."""
+    import httpx
+    from notion_client.errors import HTTPResponseError, RequestTimeoutError
+    if isinstance(error, HTTPResponseError):
+        return (getattr(error, "status", None) or 0) >= 500
+    return isinstance(error, (RequestTimeoutError, httpx.TransportError))
+
+def upload_to_notion(entries, on_result=None, on_created=None, on_unconfirmed=None):
+    """Upload new entries to Notion database.
+
+    Up to NOTION_WORKERS pages are created at once, within NOTION_RATE
+    requests per second. Returns the created page id for each entry, in
+    order, with None where the upload failed (or was skipped).
+    `on_result(entry, page_id)` is called as each upload finishes, so
+    callers can checkpoint progress; `on_created(entry, page_id)` as soon
+    as a page exists. Without `on_created`, a page whose remaining blocks
+    failed to append is archived rather than left behind as a duplicate.
+    `on_unconfirmed(entry)` replaces `on_result` when pages.create failed
+    in a way that may still have created the page.
+    """
+    client = get_notion_client()
+    database_id = os.environ.get("NOTION_DATABASE_ID")
+
+    if client is None:
+        print("Notion credentials not found. Skipping upload.")
+        return [None] * len(entries)
+
+    def upload(entry):
+        created = []
+
+        def record(page_id):
+            created.append(page_id)
+            if on_created:
+                on_created(entry, page_id)
+
+        try:
+            print(f"Uploading to Notion: {entry['title']}")
+            page_id = create_page(client, database_id, entry, on_created=record)
+        except Exception as e:
+            print(f"Failed to upload to Notion: {e}")
+            page_id = None
+            if created and on_created is None:
+                archive_page(created[0])
+            if not created and on_unconfirmed and is_unconfirmed(e):
+                inc("notion_pages_total", result="unconfirmed")
+                on_unconfirmed(entry)
+                return None
+        inc("notion_pages_total", result="created" if page_id else "failed")
+        if on_result:
+            on_result(entry, page_id)
+        return page_id
+
+    with ThreadPoolExecutor(max_workers=NOTION_WORKERS) as pool:
+        return list(pool.map(upload, entries))
+
+def upload_and_checkpoint(entries, store):
+    """Upload entries, recording each one's page id or failure in the store as it completes."""
+    if get_notion_client() is None:
+        # Leave them pending until credentials are available
+        print("Notion credentials not found. Skipping upload.")
+        return [None] * len(entries)
+
+    def created(entry, page_id):
+        store.set_notion_status(entry["id"], NOTION_PARTIAL, page_id)
+
+    def checkpoint(entry, page_id):
+        if page_id:
+            store.set_notion_status(entry["id"], NOTION_UPLOADED, page_id)
+        else:
+            # Keep the id of a page created before the failure, for discard_partial_pages
+            status, partial = store.get_notion_status(entry["id"])
+            store.set_notion_status(entry["id"], NOTION_FAILED, partial if status == NOTION_PARTIAL else None)
+
+    def unconfirmed(entry):
+        store.set_notion_status(entry["id"], NOTION_UNCONFIRMED)
+
+    return upload_to_notion(entries, on_result=checkpoint, on_created=created, on_unconfirmed=unconfirmed)
+
+def discard_partial_pages(entries, store):
+    """Archive the half-built pages of failed uploads; returns the entries ready to be uploaded again.
+
+    An entry whose partial page could not be archived is left for a later
+    retry, so it never ends up with two pages.
+    """
+    ready = []
+    for entry in entries:
+        status, page_id = store.get_notion_status(entry["id"])
+        if status in (NOTION_FAILED, NOTION_PARTIAL) and page_id:
+            if not archive_page(page_id):
+                continue
+            store.set_notion_status(entry["id"], NOTION_FAILED)
+        ready.append(entry)
+    return ready
+
+def adopt_page(entry, page_id, store):
+    """Record an existing page as the entry's upload; returns False if it is missing appended blocks.
+
+    A page found for an unconfirmed create only has the blocks sent with
+    pages.create, so a longer entry's page is kept as partial instead
+    (archived and created again by discard_partial_pages).
+    """
+    if len(build_children(entry)) > NOTION_MAX_CHILDREN:
+        store.set_notion_status(entry["id"], NOTION_FAILED, page_id)
+        return False
+    store.set_notion_status(entry["id"], NOTION_UPLOADED, page_id)
+    return True
+
+def confirm_pages(entries, store):
+    """Look up the pages of unconfirmed creates; returns the entries that still need uploading.
+
+    Found pages are adopted. An entry whose lookup fails waits for a later retry.
+    """
+    unconfirmed = {e["id"] for e in entries if store.get_notion_status(e["id"])[0] == NOTION_UNCONFIRMED}
+    if not unconfirmed:
+        return entries
+    client = get_notion_client()
+    try:
+        remote = fetch_database_pages(client, os.environ.get("NOTION_DATABASE_ID"))
+    except Exception as e:
+        print(f"Failed to look up unconfirmed Notion pages: {e}")
+        return [entry for entry in entries if entry["id"] not in unconfirmed]
+    ready = []
+    for entry in entries:
+        if entry["id"] in unconfirmed:
+            page_id = remote.get(entry_page_key(entry))
+            if page_id:
+                print(f"Found the page of an unconfirmed upload: {entry['title']}")
+                if adopt_page(entry, page_id, store):
+                    continue
+            else:
+                store.set_notion_status(entry["id"], NOTION_FAILED)
+        ready.append(entry)
+    return ready
+
+def sync_pending(store):
+    """Retry entries whose upload failed or never ran (e.g. after a crash)."""
+    entries = store.entries_with_notion_status(NOTION_PENDING, NOTION_FAILED, NOTION_PARTIAL, NOTION_UNCONFIRMED)
+    if entries and get_notion_client() is not None:
+        print(f"Retrying Notion upload for {len(entries)} entries...")
+        upload_and_checkpoint(discard_partial_pages(confirm_pages(entries, store), store), store)
+
+def _page_key(original_url, title, date_start):
+    """Identify a page by its cover URL (which embeds the diary id), else by title and day."""
+    if original_url:
+        return ("url", original_url)
+    return ("title", title or "", (date_start or "")[:10])
+
+def entry_page_key(entry):
+    properties = build_properties(entry)
+    return _page_key(
+        properties["Original URL"]["url"], entry["title"], properties["Date"]["date"]["start"]
+    )
+
+def fetch_database_pages(client, database_id):
+    """Query the whole database once (paginated) and map page keys to page ids.
+
+    Since API version 2025-09-03 pages are queried per data source; every
+    data source of the database is read.
+    """
+    pages = {}
+    database = notion_call(client.databases.retrieve, database_id=database_id)
+    for source in database.get("data_sources", []):
+        cursor = None
+        while True:
+            kwargs = {"data_source_id": source["id"], "page_size": 100}
+            if cursor:
+                kwargs["start_cursor"] = cursor
+            response = notion_call(client.data_sources.query, **kwargs)
+            for page in response.get("results", []):
+                props = page.get("properties", {})
+                title = "".join(t.get("plain_text", "") for t in props.get("Title", {}).get("title", []))
+                date = (props.get("Date", {}).get("date") or {}).get("start")
+                url = props.get("Original URL", {}).get("url")
+                pages[_page_key(url, title, date)] = page["id"]
+            if not response.get("has_more"):
+                break
+            cursor = response.get("next_cursor")
+    return pages
+
+def reconcile_notion(store):
+    """Make Notion match the store: adopt pages that already exist, upload the missing ones."""
+    client = get_notion_client()
+    if client is None:
+        print("Notion credentials not found. Skipping reconcile.")
+        return
+    remote = fetch_database_pages(client, os.environ.get("NOTION_DATABASE_ID"))
+    print(f"Found {len(remote)} pages in Notion database.")
+
+    missing = []
+    for entry in store.iter_entries():
+        page_id = remote.get(entry_page_key(entry))
+        status = store.get_notion_status(entry["id"])
+        if page_id and status in ((NOTION_FAILED, page_id), (NOTION_PARTIAL, page_id)):
+            # Half-built by a failed upload: replaced below rather than adopted
+            missing.append(entry)
+        elif page_id and status[0] == NOTION_UNCONFIRMED:
+            if not adopt_page(entry, page_id, store):
+                missing.append(entry)
+        elif page_id:
+            if status != (NOTION_UPLOADED, page_id):
+                store.set_notion_status(entry["id"], NOTION_UPLOADED, page_id)
+        else:
+            missing.append(entry)
+
+    print(f"{len(missing)} entries missing from Notion.")
+    if missing:
+        upload_and_checkpoint(discard_partial_pages(missing, store), store)
@@ -0,0 +1,131 @@
+import os
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from media import IMAGE_DIR, MANIFEST_NAME, get_manifest, save_manifest, file_digest, _manifest_lock
+
+# Opt-in post-download stage writing web-sized copies to images/web/
+OPTIMIZE_IMAGES = os.environ.get("OPTIMIZE_IMAGES", "false").lower() == "true"
+WEB_DIR = "web"
+WEB_FORMAT = os.environ.get("WEB_IMAGE_FORMAT", "webp").lower() # webp or jpeg
+WEB_MAX_SIZE = int(os.environ.get("WEB_IMAGE_MAX_SIZE", "1280")) # Longest side in pixels
+WEB_QUALITY = int(os.environ.get("WEB_IMAGE_QUALITY", "80"))
+OPTIMIZE_WORKERS = int(os.environ.get("OPTIMIZE_WORKERS", str(os.cpu_count() or 1)))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
+
+def _pillow():
+    """PIL.Image, imported on first use; None without Pillow (optional: the originals are served as before)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+def _settings():
+    return f"{WEB_FORMAT}:{WEB_MAX_SIZE}:{WEB_QUALITY}"
+
+def _web_name(filename):
+    extension = "jpg" if WEB_FORMAT == "jpeg" else WEB_FORMAT
+    return f"{WEB_DIR}/{filename}.{extension}"
+
+def _render(src, dst, fmt, max_size, quality):
+    """Write a size-capped copy of `src` to `dst` (runs in a worker process).
+
+    Returns the new size, or None when the original should be served
+    instead: animations, and images the copy would not make smaller.
+    """
+    with _pillow().open(src) as image:
+        if getattr(image, "is_animated", False):
+            return None
+        image.thumbnail((max_size, max_size))
+        if fmt == "jpeg":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.mode or "transparency" in image.info else "RGB")
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        tmp_path = f"{dst}.tmp"
+        image.save(tmp_path, format=fmt.upper(), quality=quality, optimize=True)
+    size = os.path.getsize(tmp_path)
+    if size >= os.path.getsize(src):
+        os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, dst)
+    return size
+
+def optimize_images(filenames, folder=IMAGE_DIR):
+    """Create web-sized derivatives for downloaded images in a process pool.
+
+    Returns {filename: derivative filename} for every image that has one.
+    Images whose derivative is already up to date (same source bytes and
+    settings) are not touched again; failures are retried on the next run.
+    """
+    if _pillow() is None:
+        print("Pillow not installed. Skipping image optimization.")
+        return {}
+
+    manifest = get_manifest(folder)
+    settings = _settings()
+    results = {}
+    jobs = {} # digest -> (stored filename, filenames referring to it)
+    for filename in dict.fromkeys(f for f in filenames if f):
+        if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        with _manifest_lock:
+            stored = manifest.resolve(filename)
+        path = os.path.join(folder, stored)
+        if not os.path.isfile(path):
+            continue
+        with _manifest_lock:
+            digest = manifest.files.get(stored)
+        if not digest:
+            digest = file_digest(path)
+            with _manifest_lock:
+                manifest.add(digest, stored, os.path.getsize(path))
+        with _manifest_lock:
+            known = manifest.derivatives.get(digest)
+        if known and known.get("settings") == settings:
+            web = known.get("filename")
+            if web is None:
+                continue
+            if os.path.exists(os.path.join(folder, web)):
+                results[filename] = web
+                continue
+        jobs.setdefault(digest, (stored, []))[1].append(filename)
+
+    if jobs:
+        print(f"Optimizing {len(jobs)} images ({OPTIMIZE_WORKERS} processes)...")
+        # spawn: the pipeline calls this from worker threads, where fork is unsafe
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(OPTIMIZE_WORKERS, len(jobs)), mp_context=context) as pool:
+            futures = {
+                digest: pool.submit(
+                    _render, os.path.join(folder, stored), os.path.join(folder, _web_name(stored)),
+                    WEB_FORMAT, WEB_MAX_SIZE, WEB_QUALITY,
+                )
+                for digest, (stored, _) in jobs.items()
+            }
+            saved = 0
+            for digest, future in futures.items():
+                stored, names = jobs[digest]
+                try:
+                    size = future.result()
+                except Exception as e:
+                    print(f"Failed to optimize {stored}: {e}")
+                    continue
+                web = _web_name(stored) if size is not None else None
+                with _manifest_lock:
+                    manifest.derivatives[digest] = {"filename": web, "settings": settings}
+                    manifest.dirty = True
+                if web:
+                    saved += os.path.getsize(os.path.join(folder, stored)) - size
+                    for name in names:
+                        results[name] = web
+        print(f"Optimized images save {saved / 1024 / 1024:.1f} MB")
+    save_manifest(folder)
+    return results
+
+if __name__ == "__main__":
+    # Kept for existing jobs: the command lives in main.py (python optimize.py [folder] still works)
+    from main import main
+    sys.exit(main(["optimize", *sys.argv[1:]]))
@@ -0,0 +1,97 @@
+import re
+from functools import lru_cache
+
+# Hosts whose inline media we download (img.cityheaven.net, yoasobi-heaven.com and subdomains)
+MEDIA_HOSTS = ("cityheaven.net", "yoasobi-heaven.com")
+
+# Tags carrying a src attribute (images, video posters) split the body into runs
+_MEDIA_TAG_RE = re.compile(r'<[^>]*?src="([^"]+)"[^>]*>')
+_BR_RE = re.compile(r"<br\s*/?>")
+# Every other tag, dropped before the split so the text needs no further cleanup
+_PLAIN_TAG_RE = re.compile(r'<(?![^>]*src="[^"]+")[^>]+>')
+# Text the site serves instead of a member-only (マイガール限定) diary when the cookies do not grant access.
+# Real posts often ask readers to マイガール登録, so the bare phrase is not enough.
+_MEMBER_ONLY_RE = re.compile(r"マイガール限定の日記|マイガール登録[(（]お気に入り登録[)）]する必要|Member Only")
+# Fragments every placeholder contains one of, for prefiltering in SQL (LIKE)
+MEMBER_ONLY_MARKERS = ("マイガール限定の日記", "お気に入り登録)する必要", "お気に入り登録）する必要", "Member Only")
+
+@lru_cache(maxsize=None)
+def _media_url_re(hosts):
+    # The host, or any subdomain of it, ends at the first / : ? # or at the end
+    names = "|".join(re.escape(host) for host in hosts)
+    return re.compile(rf"(?:https?:)?//(?:[^/:?#]*\.)?(?:{names})(?:[/:?#]|$)", re.IGNORECASE)
+
+def is_media_url(url, hosts=MEDIA_HOSTS):
+    """True if `url` points at one of the allowed media hosts."""
+    return _media_url_re(tuple(hosts)).match(url) is not None
+
+def is_member_only(text):
+    """True if `text` (a diary's clean text) is the member-only placeholder rather than the diary."""
+    return bool(text) and _MEMBER_ONLY_RE.search(text) is not None
+
+def parse_body(html, hosts=MEDIA_HOSTS):
+    """Split a diary body into its runs in document order.
+
+    Returns a list of {"type": "text", "content": ...} and
+    {"type": "image", "url": ...} dicts. `<br>` becomes a newline, other
+    tags are dropped, and `src` attributes on allowed hosts become image
+    runs where they appear. Joining the text runs gives exactly the text
+    the old regex cleanup produced, before stripping.
+
+    Like the old cleanup, this is two substitutions over the whole body;
+    only the media tags left after them are handled in Python.
+    """
+    # split() leaves [text, src, text, src, ..., text]
+    parts = _MEDIA_TAG_RE.split(_PLAIN_TAG_RE.sub("", _BR_RE.sub("\n", html)))
+    if len(parts) == 1:
+        return [{"type": "text", "content": parts[0]}]
+    runs = []
+    text = parts[0]
+    for i in range(1, len(parts), 2):
+        url = parts[i]
+        if url.startswith("//"):
+            url = "https:" + url
+        if is_media_url(url, hosts):
+            runs.append({"type": "text", "content": text})
+            runs.append({"type": "image", "url": url})
+            text = parts[i + 1]
+        else:
+            text += parts[i + 1]
+    runs.append({"type": "text", "content": text})
+    return runs
+
+def find_media(html, hosts=MEDIA_HOSTS):
+    """Allowed media URLs in `html`, in order, without parsing its text."""
+    urls = []
+    for url in _MEDIA_TAG_RE.findall(html):
+        if url.startswith("//"):
+            url = "https:" + url
+        if is_media_url(url, hosts):
+            urls.append(url)
+    return urls
+
+def body_text(runs):
+    """Plain text of parsed runs (images left out), stripped like the old cleanup."""
+    return "".join(run["content"] for run in runs if run["type"] == "text").strip()
+
+def body_images(runs):
+    """Image URLs of parsed runs, in order."""
+    return [run["url"] for run in runs if run["type"] == "image"]
+
+def runs_to_blocks(runs, downloaded):
+    """content_blocks for parsed runs: text blocks with the images between them.
+
+    `downloaded` maps image URLs to stored filenames; images that failed
+    to download are left out, as are whitespace-only text runs.
+    """
+    blocks = []
+    for run in runs:
+        if run["type"] == "image":
+            filename = downloaded.get(run["url"])
+            if filename:
+                blocks.append({"type": "image", "filename": filename, "url": run["url"]})
+        else:
+            content = run["content"].strip()
+            if content:
+                blocks.append({"type": "text", "content": content})
+    return blocks
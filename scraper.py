@@ -1,19 +1,64 @@
 import os
+import sys
 import json
 import time
-import hashlib
-import requests
-from pathlib import Path
-from datetime import datetime
-from deep_translator import GoogleTranslator
-from notion_client import Client
+import queue
+import signal
+import threading
+import multiprocessing
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from media import IMAGE_DIR, MAX_DOWNLOADS_PER_HOST, download_file, download_files
+from translation import translate_text, translate_texts, save_translation_cache
+from storage import DB_FILE, EntryStore, NOTION_PENDING, NOTION_FAILED
+from ratelimit import TokenBucket
+from optimize import OPTIMIZE_IMAGES, optimize_images
+from http_archive import is_recording, is_replaying, record_response, replay_page, params_key
+from metrics import inc, stage, write_reports
+from parsing import parse_body, body_text, body_images, find_media, runs_to_blocks, is_member_only
+from transport import POOL_SIZE, create_session
+from notion_sync import upload_to_notion, upload_and_checkpoint, sync_pending, reconcile_notion, archive_page
 
 # Configuration
 BASE_URL = "https://yoasobi-heaven.com"
 API_URL = f"{BASE_URL}/api/diary/diary-list/"
 CSRF_URL = f"{BASE_URL}/api/csrf-token/"
-IMAGE_DIR = "images"
-DATA_FILE = "data_store.json"
+
+# Cookie jar + CSRF token reused across runs (contains credentials: never commit it)
+SESSION_CACHE_FILE = ".session_cache.json"
+CSRF_TOKEN_TTL = float(os.environ.get("CSRF_TOKEN_TTL", "3600"))
+# Responses meaning the session or CSRF token is no longer accepted (419: CSRF token mismatch)
+AUTH_FAILURE_STATUSES = (401, 403, 419)
+
+# Pagination: diary-list requests per second, and the safety cap on pages per run
+PAGE_RATE = float(os.environ.get("PAGE_RATE", "1"))
+MAX_PAGES = 100
+
+# Gap scan: fetch only the page ranges the store is missing, instead of new posts
+GAP_SCAN = os.environ.get("GAP_SCAN", "false").lower() == "true"
+
+# Diaries to follow (falls back to params.json), and how many are paginated at once
+TARGETS_FILE = "targets.json"
+TARGET_CONCURRENCY = int(os.environ.get("TARGET_CONCURRENCY", "4"))
+
+# Streaming pipeline: items buffered between stages (page batches, then entries before saving)
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "4"))
+# Raw records processed together by the separate process stage (about one page)
+PROCESS_BATCH = 10
+
+# Member-only entries still locked are re-fetched at most this often (seconds), while YOASOBI_COOKIES is set
+LOCKED_RETRY_INTERVAL = float(os.environ.get("LOCKED_RETRY_INTERVAL", "86400"))
+
+# Watch mode: seconds between polls in the busiest hour of the day, and at most (quiet hours)
+WATCH_MIN_INTERVAL = float(os.environ.get("WATCH_MIN_INTERVAL", "7200"))
+WATCH_MAX_INTERVAL = float(os.environ.get("WATCH_MAX_INTERVAL", "21600"))
+# Polls run on a grid starting this many seconds past each hour: most posts are scheduled on the hour
+WATCH_OFFSET = float(os.environ.get("WATCH_OFFSET", "60"))
+
+# Re-rendering stored raw entries: worker processes, entries per task, entries loaded at once
+RERENDER_WORKERS = int(os.environ.get("RERENDER_WORKERS", str(os.cpu_count() or 1)))
+RERENDER_CHUNK = 100
+RERENDER_BATCH = 2000
 
 # Headers mimicking a browser
 HEADERS = {
@@ -24,15 +69,69 @@ HEADERS = {
     "X-Requested-With": "XMLHttpRequest",
 }
 
+_token_lock = threading.Lock()
+
 def load_params():
     """Load API parameters from local JSON file."""
     with open("params.json", "r") as f:
         return json.load(f)
 
+def load_targets():
+    """Load the diaries to follow.
+    
+    targets.json holds a list of {"name": ..., "params": {...}} objects, each
+    "params" in the params.json format (one member/shop set per target).
+    Without targets.json, params.json is the only target.
+    """
+    if os.path.exists(TARGETS_FILE):
+        with open(TARGETS_FILE, "r", encoding="utf-8") as f:
+            targets = json.load(f)
+        print(f"Loaded {len(targets)} targets from {TARGETS_FILE}")
+        return targets
+    return [{"name": "params.json", "params": load_params()}]
+
+def load_session_cache():
+    """Return the persisted cookie jar and CSRF token, or None if missing or past its TTL."""
+    if not os.path.exists(SESSION_CACHE_FILE):
+        return None
+    try:
+        with open(SESSION_CACHE_FILE, "r") as f:
+            cache = json.load(f)
+    except Exception as e:
+        print(f"Error loading session cache: {e}")
+        return None
+    if time.time() - cache.get("fetched_at", 0) > CSRF_TOKEN_TTL:
+        return None
+    return cache
+
+def save_session_cache(session):
+    """Persist the session's cookies and CSRF token for the next run."""
+    token = getattr(session, "csrf_token", None)
+    if not token:
+        return
+    cache = {
+        "token": token,
+        "fetched_at": getattr(session, "csrf_fetched_at", time.time()),
+        "cookies": [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+            for c in session.cookies
+        ],
+    }
+    tmp_path = f"{SESSION_CACHE_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, SESSION_CACHE_FILE)
+
 def get_session():
     """Initialize session with Age Gate bypass and optional User Cookies."""
-    session = requests.Session()
-    session.headers.update(HEADERS)
+    # One session is shared by every target and download worker: pool enough connections for them
+    session = create_session(HEADERS, pool_size=max(POOL_SIZE, TARGET_CONCURRENCY + MAX_DOWNLOADS_PER_HOST))
+    
+    # 0. Cookies saved by a previous run (the CSRF token is bound to them)
+    cache = load_session_cache()
+    if cache:
+        for c in cache.get("cookies", []):
+            session.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"])
     
     # 1. Base Age Gate Cookie (Always required)
     session.cookies.set("age_checked", "true", domain="yoasobi-heaven.com")
@@ -52,8 +151,21 @@ def get_session():
             
     return session
 
-def get_csrf_token(session):
-    """Fetch CSRF token from the API."""
+def get_csrf_token(session, refresh=False):
+    """Fetch CSRF token from the API.
+    
+    A token persisted by an earlier run is reused while it is younger than
+    CSRF_TOKEN_TTL, unless `refresh` is set. The token in use is kept on
+    the session as `session.csrf_token`.
+    """
+    if not refresh:
+        cache = load_session_cache()
+        if cache and cache.get("token"):
+            session.csrf_token = cache["token"]
+            session.csrf_fetched_at = cache["fetched_at"]
+            print(f"Using cached CSRF token: {session.csrf_token[:10]}...")
+            return session.csrf_token
+    
     print("Fetching CSRF token...")
     try:
         response = session.get(CSRF_URL)
@@ -64,507 +176,961 @@ def get_csrf_token(session):
             print("Error: Token not found in response")
             return None
         print(f"CSRF Token obtained: {token[:10]}...")
+        session.csrf_token = token
+        session.csrf_fetched_at = time.time()
+        save_session_cache(session)
         return token
     except Exception as e:
         print(f"Failed to get CSRF token: {e}")
         return None
 
+def refresh_csrf_token(session, rejected_token):
+    """Replace a token the API rejected; returns True if a usable token is in place.
+    
+    Concurrent callers that saw the same rejected token share one refresh.
+    """
+    with _token_lock:
+        current = getattr(session, "csrf_token", None)
+        if current and current != rejected_token:
+            return True # Another thread already refreshed it
+        return get_csrf_token(session, refresh=True) is not None
+
 def fetch_diary_entries(session, token, params, page=1):
-    """Fetch diary entries for a specific page."""
+    """Fetch diary entries for a specific page.
+    
+    If the API rejects the session (401/403/419 or an unsuccessful
+    response), the CSRF token is refreshed and the page is retried once
+    instead of ending pagination early.
+    
+    With HTTP_ARCHIVE=record each raw response is archived; with
+    HTTP_ARCHIVE=replay pages come from the archive and nothing is sent.
+    """
+    if is_replaying():
+        entries = replay_page(params, page)
+        print(f"Replayed {len(entries)} entries for page {page}.")
+        return entries
+    
     print(f"Fetching diary entries (Page {page})...")
     params["page"] = page
-    headers = {
-        "Content-Type": "application/json",
-        "X-CSRF-TOKEN": token
-    }
     
-    try:
-        response = session.post(API_URL, json=params, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+    for attempt in range(2):
+        # Prefer the session's current token: it may have been refreshed since `token` was handed out
+        token = getattr(session, "csrf_token", None) or token
+        headers = {
+            "Content-Type": "application/json",
+            "X-CSRF-TOKEN": token
+        }
         
-        if not data.get("success"):
-            print("API returned unsuccessful status")
-            return []
+        try:
+            response = session.post(API_URL, json=params, headers=headers)
+            rejected = response.status_code in AUTH_FAILURE_STATUSES
+            if not rejected:
+                response.raise_for_status()
+                data = response.json()
+                rejected = not data.get("success")
             
-        entries = data.get("diaryData", {}).get("diary_pc_page_data", [])
-        print(f"Found {len(entries)} entries on page {page}.")
-        return entries
-    except Exception as e:
-        print(f"Failed to fetch diary entries: {e}")
-        return []
+            if rejected:
+                if attempt == 0 and refresh_csrf_token(session, token):
+                    print(f"Session rejected on page {page}; retrying with a fresh CSRF token...")
+                    continue
+                print("API returned unsuccessful status")
+                return []
+                
+            if is_recording():
+                record_response(params, page, response.content)
+            
+            entries = data.get("diaryData", {}).get("diary_pc_page_data", [])
+            print(f"Found {len(entries)} entries on page {page}.")
+            return entries
+        except Exception as e:
+            print(f"Failed to fetch diary entries: {e}")
+            return []
+    return []
+
+download_image = download_file
+
+# Diary dates are JST without a year
+JST = timezone(timedelta(hours=9))
 
-def download_file(url, folder="images", session=None, referer=None):
-    """Download file and return filename if successful.
+def prepare_entry(entry):
+    """Parse a raw API entry: (entry, text_runs, clean_text_jp, inline_images, video_url).
     
-    Args:
-        url: URL of the file to download
-        folder: Destination folder
-        session: Optional requests.Session for reusing cookies/headers
-        referer: Optional referer URL to bypass anti-hotlinking
+    Pure CPU work with no I/O, so it can run in worker processes.
+    """
+    diary_id = entry.get("c_diary_id")
+    
+    # The text source (Japanese original if present) is parsed; a separate HTML body is only scanned for media
+    html_body = entry.get("body", "") or entry.get("pcbody", "")
+    raw_text = entry.get("decoded_body_org", "") or entry.get("body", "")
+    text_runs = parse_body(raw_text)
+    text_images = body_images(text_runs)
+    body_media = text_images if raw_text == html_body else find_media(html_body)
+    # Images found in the text keep their position; other body images follow the translation
+    placed = set(text_images)
+    inline_images = [url for url in dict.fromkeys(body_media) if url not in placed]
+    
+    video_url = None
+    movie_file = entry.get("movie_filename")
+    if movie_file:
+        commu_id = entry.get("c_commu_id")
+        member_id = entry.get("c_member_id")
+        video_url = f"https://img.cityheaven.net/cs/mvdiary/{commu_id}/{member_id}/{diary_id}/{movie_file}"
+    
+    # PREPARE TEXT
+    # <br> becomes a newline, other tags are dropped
+    clean_text_jp = body_text(text_runs)
+    
+    return entry, text_runs, clean_text_jp, inline_images, video_url
+
+def fetch_resources(prepared, session=None):
+    """Translate and download everything a batch of prepared entries needs.
+    
+    Returns (translated_texts, downloaded, web_files). Media already on disk
+    and cached translations are reused without any request.
     """
-    if not url:
+    # Collect every media URL and text of the batch up front so downloads and translation run concurrently
+    media_urls = []
+    media_refs = {} # URL -> ids of the entries using it, kept in the media manifest
+    for entry, text_runs, _, inline_images, video_url in prepared:
+        entry_urls = [entry.get("girls_image_url"), *body_images(text_runs), *inline_images, video_url]
+        media_urls.extend(entry_urls)
+        for url in entry_urls:
+            if url:
+                media_refs.setdefault(url, set()).add(str(entry.get("c_diary_id")))
+    
+    def translate_batch(texts):
+        with stage("translate"):
+            return translate_texts(texts)
+    
+    # Translate the whole batch in the background while the media downloads
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        translations = pool.submit(translate_batch, [p[2] for p in prepared])
+        # Download with anti-hotlinking protection
+        with stage("download"):
+            downloaded = download_files(media_urls, session=session, referer=BASE_URL, refs=media_refs)
+        # Web-sized copies (optional) are made while translation is still running
+        with stage("optimize"):
+            web_files = optimize_images(downloaded.values()) if OPTIMIZE_IMAGES else {}
+        translated_texts = translations.result()
+    return translated_texts, downloaded, web_files
+
+def parse_timestamp(date_str, now=None):
+    """UTC timestamp of a JST diary date without a year ("12/29 18:00"), or None.
+    
+    The year is the one that puts the date no later than a day after `now`
+    (default: the current time).
+    """
+    if not date_str:
         return None
-        
+    now = now or datetime.now(JST)
     try:
-        # Create folder if not exists
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-            
-        filename = os.path.basename(url.split("?")[0]) # Handle query params
-        filepath = os.path.join(folder, filename)
+        # Parse naive time first (12/29 18:00)
+        dt_naive = datetime.strptime(f"{now.year}/{date_str}", "%Y/%m/%d %H:%M")
         
-        # Helper to check if valid (simple size check or existence)
-        if os.path.exists(filepath):
-            return filename
-            
-        # Download with anti-hotlinking protection
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        }
+        # Make it JST aware
+        dt_jst = dt_naive.replace(tzinfo=JST)
         
-        # Add referer if provided (important for anti-hotlinking)
-        if referer:
-            headers["Referer"] = referer
-            
-        # Use session if provided, otherwise use requests directly
-        requester = session if session else requests
-        r = requester.get(url, headers=headers, stream=True)
+        # Year Wrap Logic: Compare against JST time
+        # If date is in future (> now + 1 day), it implies previous year
+        if dt_jst > now + timedelta(days=1):
+            dt_jst = dt_jst.replace(year=now.year - 1)
         
-        if r.status_code == 200:
-            with open(filepath, 'wb') as f:
-                for chunk in r.iter_content(1024):
-                    f.write(chunk)
-            print(f"Downloaded: {filename}")
-            return filename
-        else:
-            print(f"Failed to download {url}: {r.status_code}")
-            return None
+        # Convert to UTC timestamp (standard for machines)
+        return dt_jst.timestamp()
     except Exception as e:
-        print(f"Error downloading {url}: {e}")
+        print(f"Error parsing date '{date_str}': {e}")
         return None
 
-download_image = download_file
-
-def translate_text(text):
-    """Translate Japanese text to Simplified Chinese using Google Translate (Deep Translator)."""
-    if not text:
-        return ""
+def build_entry(prepared, translated_text, downloaded, web_files, now=None, timestamp=None):
+    """Assemble the processed entry (cover, content_blocks, timestamp) from a prepared entry.
     
-    # Basic deduplication/cache check could go here
+    The year of the JST date is inferred relative to `now` (default: the
+    current time) unless a known `timestamp` is passed. No I/O.
+    """
+    entry, text_runs, clean_text_jp, inline_images, video_url = prepared
+    diary_id = entry.get("c_diary_id")
+    current_now_jst = now or datetime.now(JST)
+        
+    print(f"Processing new entry: {entry.get('subject')}")
     
-    try:
-        # Use deep_translator for robust free translation
-        translated = GoogleTranslator(source='auto', target='zh-CN').translate(text)
-        return translated
-    except Exception as e:
-        print(f"Translation error: {e}")
-        return text # Fallback to original
+    # 1. Main Cover Image/Video Detection
+    cover_url = entry.get("girls_image_url")
+    cover_filename = None
+    cover_type = "image"  # default
+    
+    if cover_url:
+        # Detect if cover is a video by extension
+        cover_ext = os.path.splitext(cover_url.split("?")[0])[1].lower()
+        if cover_ext in ['.mp4', '.mov', '.avi', '.webm']:
+            cover_type = "video"
+            print(f"  Detected video cover: {cover_url}")
+        
+        cover_filename = downloaded.get(cover_url)
+    
+    # 2. Rich Content Extraction
+    content_blocks = []
+    
+    # Add video cover at the top if cover is a video
+    if cover_type == "video" and cover_filename:
+        content_blocks.append({
+            "type": "video", 
+            "filename": cover_filename, 
+            "url": cover_url,
+            "is_cover": True  # Mark this as the cover video
+        })
+        content_blocks.append({"type": "divider"})
+    
+    # STRUCTURE:
+    # [Heading] 原文
+    # [Text] JP (with any images it contains, in place)
+    # [Divider]
+    # [Heading] 译文
+    # [Text] CN
+    # [Divider]
+    # [Media]
+    
+    content_blocks.append({"type": "heading_2", "content": "🇯🇵 原文"})
+    content_blocks.extend(runs_to_blocks(text_runs, downloaded) or [{"type": "text", "content": clean_text_jp}])
+    
+    content_blocks.append({"type": "divider"})
+    
+    content_blocks.append({"type": "heading_2", "content": "🇨🇳 译文"})
+    content_blocks.append({"type": "text", "content": translated_text})
+    
+    content_blocks.append({"type": "divider"})
+
+    # B. Inline Images from Body
+    for img_src in inline_images:
+        f_name = downloaded.get(img_src)
+        if f_name:
+            content_blocks.append({"type": "image", "filename": f_name, "url": img_src})
 
-import re
+    # C. Video
+    if video_url:
+        print(f"Found video: {video_url}")
+        
+        v_name = downloaded.get(video_url)
+        if v_name:
+             content_blocks.append({"type": "video", "filename": v_name, "url": video_url})
+        else:
+             content_blocks.append({"type": "video", "url": video_url})
 
-# ... existing imports ...
+    # Point image blocks at their web-sized copy, if one was made
+    for block in content_blocks:
+        if block.get("type") == "image" and block.get("filename") in web_files:
+            block["web_filename"] = web_files[block["filename"]]
 
-def process_and_save(entries, session=None):
+    # 3. Parse Date (JST Aware)
+    date_str = entry.get("create_date") 
+    if timestamp is None:
+        # Default fallback (local system time)
+        timestamp = parse_timestamp(date_str, current_now_jst) or time.time()
+            
+    return {
+        "id": diary_id,
+        "date": date_str,
+        "title": entry.get("subject"),
+        "original_text": clean_text_jp,
+        "translated_text": translated_text,
+        "cover_filename": cover_filename,
+        "cover_type": cover_type,  # "image" or "video"
+        "image_url_original": cover_url,
+        "timestamp": timestamp,
+        "content_blocks": content_blocks
+    }
+
+def process_and_save(entries, session=None, store=None, reprocess=False):
     """Process entries, translate, download images, and prepare for Notion.
     
     Args:
         entries: List of diary entries
         session: Optional requests.Session for downloading files
+        store: Optional EntryStore used to skip already processed entries
+        reprocess: Rebuild entries even if the store already has them
     """
-    # ... existing processed_ids check ...
-    processed_ids = set()
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, "r") as f:
-                old_data = json.load(f)
-                processed_ids = set(item["id"] for item in old_data)
-        except:
-            pass
+    if store is None and not reprocess:
+        with EntryStore() as default_store:
+            return process_and_save(entries, session=session, store=default_store)
 
-    new_entries = []
-    # Timezone definition (JST = UTC+9)
-    from datetime import timezone, timedelta
-    JST = timezone(timedelta(hours=9))
-    current_now_jst = datetime.now(JST)
-    current_year = current_now_jst.year
+    prepared = [
+        prepare_entry(entry) for entry in entries
+        if reprocess or entry.get("c_diary_id") not in store
+    ]
+    # Cookie validation: a member-only diary served as its placeholder is queued for refetch_locked
+    # instead of translating the placeholder and downloading its teaser media
+    locked = [p[0] for p in prepared if is_member_only(p[2])]
+    if locked:
+        print(f"⚠️  WARNING: {len(locked)} Member Only entries skipped! Your YOASOBI_COOKIES might be invalid or expired.")
+        inc("locked_entries_total", len(locked), result="queued")
+        if store is not None:
+            now = datetime.now(JST)
+            store.add_locked([(e.get("c_diary_id"), parse_timestamp(e.get("create_date"), now)) for e in locked])
+        prepared = [p for p in prepared if not is_member_only(p[2])]
+    translated_texts, downloaded, web_files = fetch_resources(prepared, session=session)
     
-    for entry in entries:
-        diary_id = entry.get("c_diary_id")
-        
-        if diary_id in processed_ids:
-            # print(f"Skipping duplicate entry {diary_id}")
-            continue
-            
-        print(f"Processing new entry: {entry.get('subject')}")
-        
-        # 1. Main Cover Image/Video Detection
-        cover_url = entry.get("girls_image_url")
-        cover_filename = None
-        cover_type = "image"  # default
-        
-        if cover_url:
-            # Detect if cover is a video by extension
-            cover_ext = os.path.splitext(cover_url.split("?")[0])[1].lower()
-            if cover_ext in ['.mp4', '.mov', '.avi', '.webm']:
-                cover_type = "video"
-                print(f"  Detected video cover: {cover_url}")
-            
-            # Download with anti-hotlinking protection
-            cover_filename = download_file(cover_url, session=session, referer=BASE_URL)
-        
-        # 2. Content & Cookie Validation
-        raw_text = entry.get("decoded_body_org", "") or entry.get("body", "")
-        if "マイガール登録" in raw_text or "Member Only" in raw_text:
-             print("⚠️  WARNING: Member Only content detected! Your YOASOBI_COOKIES might be invalid or expired.")
-
-        # 3. Rich Content Extraction
-        content_blocks = []
-        
-        # Add video cover at the top if cover is a video
-        if cover_type == "video" and cover_filename:
-            content_blocks.append({
-                "type": "video", 
-                "filename": cover_filename, 
-                "url": cover_url,
-                "is_cover": True  # Mark this as the cover video
-            })
-            content_blocks.append({"type": "divider"})
-        
-        # PREPARE TEXT
-        # Simple HTML to text cleanup (preserving newlines)
-        # Use simple replaces to keep it fast and dependency-free (no BS4 needed yet)
-        clean_text_jp = re.sub(r'<br\s*/?>', '\n', raw_text)
-        clean_text_jp = re.sub(r'<[^>]+>', '', clean_text_jp) # Remove other tags
-        clean_text_jp = clean_text_jp.strip()
-        
-        translated_text = translate_text(clean_text_jp)
-        
-        # STRUCTURE:
-        # [Heading] 原文
-        # [Text] JP
-        # [Divider]
-        # [Heading] 译文
-        # [Text] CN
-        # [Divider]
-        # [Media]
-        
-        content_blocks.append({"type": "heading_2", "content": "🇯🇵 原文"})
-        content_blocks.append({"type": "text", "content": clean_text_jp})
-        
-        content_blocks.append({"type": "divider"})
-        
-        content_blocks.append({"type": "heading_2", "content": "🇨🇳 译文"})
-        content_blocks.append({"type": "text", "content": translated_text})
-        
-        content_blocks.append({"type": "divider"})
-
-        # B. Inline Images from Body
-        html_body = entry.get("body", "") or entry.get("pcbody", "")
-        inline_images = re.findall(r'src="([^"]+)"', html_body)
-        
-        for img_src in inline_images:
-            if "cityheaven.net" in img_src or "yoasobi-heaven" in img_src:
-                f_name = download_file(img_src, session=session, referer=BASE_URL)
-                if f_name:
-                    content_blocks.append({"type": "image", "filename": f_name, "url": img_src})
-
-        # C. Video
-        movie_file = entry.get("movie_filename")
-        if movie_file:
-            commu_id = entry.get("c_commu_id")
-            member_id = entry.get("c_member_id")
-            video_url = f"https://img.cityheaven.net/cs/mvdiary/{commu_id}/{member_id}/{diary_id}/{movie_file}"
-            print(f"Found video: {video_url}")
-            
-            v_name = download_file(video_url, session=session, referer=BASE_URL)
-            if v_name:
-                 content_blocks.append({"type": "video", "filename": v_name, "url": video_url})
-            else:
-                 content_blocks.append({"type": "video", "url": video_url})
-
-        # 4. Parse Date (JST Aware)
-        date_str = entry.get("create_date") 
-        timestamp = time.time() # Default fallback (local system time)
-        
-        if date_str:
-            try:
-                # Parse naive time first (12/29 18:00)
-                dt_naive = datetime.strptime(f"{current_year}/{date_str}", "%Y/%m/%d %H:%M")
-                
-                # Make it JST aware
-                dt_jst = dt_naive.replace(tzinfo=JST)
-                
-                # Year Wrap Logic: Compare against JST time
-                # If date is in future (> now + 1 day), it implies previous year
-                if dt_jst > current_now_jst + timedelta(days=1):
-                    dt_jst = dt_jst.replace(year=current_year - 1)
-                
-                # Convert to UTC timestamp (standard for machines)
-                timestamp = dt_jst.timestamp()
-                
-                # Debug output
-                # print(f"Date: {date_str} -> {dt_jst} -> TS: {timestamp}")
-                
-            except Exception as e:
-                print(f"Error parsing date '{date_str}': {e}")
-                
-        processed_entry = {
-            "id": diary_id,
-            "date": date_str,
-            "title": entry.get("subject"),
-            "original_text": clean_text_jp,
-            "translated_text": translated_text,
-            "cover_filename": cover_filename,
-            "cover_type": cover_type,  # "image" or "video"
-            "image_url_original": cover_url,
-            "timestamp": timestamp,
-            "content_blocks": content_blocks
-        }
-        
-        new_entries.append(processed_entry)
+    now = datetime.now(JST)
+    new_entries = [
+        build_entry(p, translated_text, downloaded, web_files, now=now)
+        for p, translated_text in zip(prepared, translated_texts)
+    ]
         
     # Sort new entries by timestamp descending (Newest First)
     new_entries.sort(key=lambda x: x["timestamp"], reverse=True)
+    
+    save_translation_cache()
         
     return new_entries
 
-def upload_to_notion(entries):
-    """Upload new entries to Notion database."""
-    token = os.environ.get("NOTION_TOKEN")
-    database_id = os.environ.get("NOTION_DATABASE_ID")
-    github_repo = os.environ.get("GITHUB_REPOSITORY")
+def iter_new_entries(session, token, params, existing_ids, limiter=None, cursor=None, listing=None, backfill=None):
+    """Paginate the diary list, yielding (page, new_entries) as each page is filtered.
     
-    if not token or not database_id:
-        print("Notion credentials not found. Skipping upload.")
-        return
-
-    client = Client(auth=token)
+    The request for the next page is issued before the current page is handed
+    to the caller (and, in BACKFILL mode, before it is even filtered), so
+    network time overlaps with whatever the caller does with the entries.
+    Requests are paced by `limiter` (PAGE_RATE pages per second by default).
     
-    for entry in entries:
-        try:
-            print(f"Uploading to Notion: {entry['title']}")
+    In standard mode, `cursor` ((entry_id, timestamp) from the store) ends
+    pagination as soon as the listing reaches it, even mid-page: the cursor
+    entry itself or anything older than its timestamp. `listing`, if given,
+    is filled for advance_cursor: "seen" gets the ids listed before that
+    point (newest first), "reached" whether the walk got there.
+    """
+    # Backfill mode: If True, we don't stop when we hit an existing ID.
+    # We continue fetching until the API returns nothing.
+    force_backfill = os.environ.get("BACKFILL", "false").lower() == "true" if backfill is None else backfill
+    
+    if force_backfill:
+        print("BACKFILL mode enabled: Will scan all pages despite existing data.")
+    
+    cursor_id, cursor_ts = (None, None) if force_backfill or cursor is None else cursor
+    if listing is None:
+        listing = {}
+    seen = listing.setdefault("seen", [])
+    listing["reached"] = False
+    
+    # Be nice to the server
+    limiter = limiter or TokenBucket(PAGE_RATE, capacity=1, name="pages")
+    
+    def fetch_page(page):
+        if not is_replaying(): # Replayed pages cost no requests
+            limiter.acquire()
+        # fetch_diary_entries writes the page number into params, so give each request its own copy
+        with stage("fetch_page"):
+            return fetch_diary_entries(session, token, dict(params), page)
+    
+    page = 1
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        next_page = pool.submit(fetch_page, page)
+        while True:
+            entries = next_page.result()
+            next_page = None
+            if not entries:
+                print("No more entries found. Stopping pagination.")
+                break
+            
+            # In BACKFILL mode every non-empty page leads to the next one: prefetch it now
+            if force_backfill and page <= MAX_PAGES:
+                next_page = pool.submit(fetch_page, page + 1)
             
-            # Construct GitHub raw URL for images
-            def get_gh_url(filename):
-                if github_repo:
-                    return f"https://raw.githubusercontent.com/{github_repo}/main/images/{filename}"
-                return None
-
-            # 1. Prepare Block Children (The Page Content)
-            children_blocks = []
+            new_entries = []
+            total_items = len(entries)
+            reached = False
             
-            for block in entry.get("content_blocks", []):
-                b_type = block.get('type')
+            for entry in entries:
+                diary_id = str(entry.get("c_diary_id"))
+                
+                # Everything from the cursor down is already stored
+                if cursor_id is not None and (diary_id == cursor_id or (
+                        cursor_ts is not None and (parse_timestamp(entry.get("create_date")) or cursor_ts) < cursor_ts)):
+                    reached = True
+                    break
+                seen.append(diary_id)
+                
+                if diary_id in existing_ids:
+                    # Skip duplicate
+                    continue
                 
-                if b_type == 'heading_2':
-                    children_blocks.append({
-                        "object": "block",
-                        "type": "heading_2",
-                        "heading_2": {
-                            "rich_text": [{"type": "text", "text": {"content": block['content']}}]
-                        }
-                    })
-                elif b_type == 'divider':
-                    children_blocks.append({
-                        "object": "block",
-                        "type": "divider",
-                        "divider": {}
-                    })
-                elif b_type == 'text':
-                    for line in block['content'].split('\n'):
-                        if line.strip():
-                            children_blocks.append({
-                                "object": "block",
-                                "type": "paragraph",
-                                "paragraph": {
-                                    "rich_text": [{"type": "text", "text": {"content": line[:2000]}}]
-                                }
-                            })
-                elif b_type == 'image':
-                    img_gh_url = get_gh_url(block['filename']) or block['url']
-                    children_blocks.append({
-                        "object": "block",
-                        "type": "image",
-                        "image": {
-                            "type": "external",
-                            "external": {"url": img_gh_url}
-                        }
-                    })
-                elif b_type == 'video':
-                    # Use GitHub URL if filename exists
-                    vid_src = block.get('url')
-                    if block.get('filename'):
-                        vid_src = get_gh_url(block['filename']) or vid_src
-
-                    children_blocks.append({
-                        "object": "block",
-                        "type": "video",
-                        "video": {
-                            "type": "external",
-                            "external": {"url": vid_src}
-                        }
-                    })
-
-            # Main Image (at top of content too?)
-            # Usually Cover Image is set as page cover or just main property. 
-            # We already set it in 'Image' property. User might want it in body too?
-            # Let's create the page first with properties.
-
-            # Handle video vs image cover
-            # If cover is a video, we've already added it to content_blocks at the top
-            # For the Image property, we'll use the first image from content or None
+                new_entries.append(entry)
+                
+            print(f"Page {page}: Found {len(new_entries)} new entries out of {total_items}.")
             
-            cover_type = entry.get('cover_type', 'image')
-            cover_filename = entry.get('cover_filename')
+            # Stop Condition for Standard Mode
+            stop = False
+            if not force_backfill:
+                if reached:
+                    print(f"Reached the last seen entry ({cursor_id}). Stopping pagination.")
+                    stop = True
+                elif not new_entries:
+                    print("No new entries found on this page. Stopping pagination.")
+                    stop = True
+                listing["reached"] = stop
             
-            # Prepare Image property
-            image_property = None
-            if cover_type == 'image' and cover_filename:
-                # Normal image cover
-                cover_gh_url = get_gh_url(cover_filename) or entry.get('image_url_original')
-                if cover_gh_url:
-                    image_property = {
-                        "files": [
-                            {
-                                "name": cover_filename,
-                                "type": "external",
-                                "external": {"url": cover_gh_url}
-                            }
-                        ]
-                    }
-            else:
-                # Cover is video or missing, try to find first image from content
-                for block in entry.get('content_blocks', []):
-                    if block.get('type') == 'image' and block.get('filename'):
-                        img_gh_url = get_gh_url(block['filename']) or block.get('url')
-                        if img_gh_url:
-                            image_property = {
-                                "files": [
-                                    {
-                                        "name": block['filename'],
-                                        "type": "external",
-                                        "external": {"url": img_gh_url}
-                                    }
-                                ]
-                            }
-                            break
-
-            # Build properties
-            properties = {
-                "Date": {"date": {"start": datetime.fromtimestamp(entry["timestamp"]).isoformat()}},
-                "Title": {"title": [{"text": {"content": entry["title"]}}]},
-                "Content (JP)": {"rich_text": [{"text": {"content": entry["original_text"][:2000]}}]},
-                "Content (CN)": {"rich_text": [{"text": {"content": entry["translated_text"][:2000]}}]},
-                "Original URL": {"url": entry.get("image_url_original", "")},
-            }
+            # Safety limit to prevent infinite loops (e.g. if logic fails)
+            if not stop and page > MAX_PAGES and not is_replaying():
+                print(f"Reached page {MAX_PAGES} limit. Stopping.")
+                stop = True
             
-            # Add Image property if we have one
-            if image_property:
-                properties["Image"] = image_property
-
-            client.pages.create(
-                parent={"database_id": database_id},
-                properties=properties,
-                children=children_blocks
-            )
-            time.sleep(0.5) 
-        except Exception as e:
-            print(f"Failed to upload to Notion: {e}")
+            if not stop and next_page is None:
+                next_page = pool.submit(fetch_page, page + 1)
+            
+            yield page, new_entries
+            
+            if stop:
+                break
+            page += 1
+
+def advance_cursor(store, params, listing):
+    """Move the target's cursor up to the newest listed entry below which everything is stored.
+    
+    `listing` comes from iter_new_entries. Walking up from the oldest id
+    seen, the cursor stops below the first one that is neither in the store
+    nor queued as locked, so an entry that failed to process is listed
+    again on the next run. Nothing moves unless the walk really reached the
+    old cursor (a failed page request also ends pagination) or if it would
+    move the cursor back.
+    """
+    if not listing.get("reached"):
+        return
+    newest = None
+    for diary_id in reversed(listing.get("seen", [])):
+        if diary_id not in store and not store.is_locked(diary_id):
+            break
+        newest = diary_id
+    if newest is None:
+        return
+    target = params_key(params)
+    timestamp = store.get_timestamps([newest]).get(newest) or store.locked_entries().get(newest)
+    _, current = store.get_cursor(target)
+    if current is not None and (timestamp is None or timestamp < current):
+        return
+    store.set_cursor(target, newest, timestamp)
+    print(f"Cursor for {target} moved to {newest}")
+
+def iter_gap_entries(session, token, params, store, limiter=None):
+    """Yield (page, missing_entries) for only the pages holding entries missing from the store.
+    
+    The listing is newest first, so a run of pages is complete when its
+    first and last pages are fully stored and the store holds at least as
+    many entries in its time span as the pages list (member-only entries
+    queued as locked count as stored). The last page is found by doubling,
+    then incomplete ranges are bisected down to single pages: for a few
+    gaps only O(log pages) pages are requested. The count is over the whole
+    store, so this assumes one target per store.
+    """
+    limiter = limiter or TokenBucket(PAGE_RATE, capacity=1, name="pages")
+    fetched = {}
+    
+    def page_entries(page):
+        if page not in fetched:
+            if not is_replaying():
+                limiter.acquire()
+            with stage("fetch_page"):
+                fetched[page] = fetch_diary_entries(session, token, dict(params), page)
+        return fetched[page]
+    
+    def missing(page):
+        return [e for e in page_entries(page)
+                if str(e.get("c_diary_id")) not in store and not store.is_locked(e.get("c_diary_id"))]
+    
+    def timestamps(page):
+        entries = page_entries(page)
+        stored = store.get_timestamps(str(e.get("c_diary_id")) for e in entries)
+        return [t for t in (
+            stored.get(str(e.get("c_diary_id"))) or parse_timestamp(e.get("create_date")) for e in entries
+        ) if t is not None]
+    
+    page_size = len(page_entries(1))
+    if not page_size:
+        print("No entries found.")
+        return
+    
+    # Last non-empty page, capped like BACKFILL
+    last, probe = 1, 2
+    while probe <= MAX_PAGES + 1 and page_entries(probe):
+        last, probe = probe, probe * 2
+    probe = min(probe, MAX_PAGES + 2)
+    while probe - last > 1:
+        middle = (last + probe) // 2
+        if page_entries(middle):
+            last = middle
+        else:
+            probe = middle
+    print(f"Gap scan: {last} pages of up to {page_size} entries")
+    
+    def complete(first, final):
+        if missing(first) or missing(final):
+            return False
+        listed = (final - first) * page_size + len(page_entries(final))
+        newest, oldest = max(timestamps(first), default=None), min(timestamps(final), default=None)
+        return newest is not None and oldest is not None and store.count_between(oldest, newest) >= listed
+    
+    def scan(first, final):
+        if first == final:
+            entries = missing(first)
+            if entries:
+                print(f"Page {first}: {len(entries)} entries missing from the store.")
+                yield first, entries
+            return
+        if complete(first, final):
+            return
+        middle = (first + final) // 2
+        yield from scan(first, middle)
+        yield from scan(middle + 1, final)
+    
+    yield from scan(1, last)
+    print(f"Gap scan done: {len(fetched)} pages requested.")
 
 def fetch_all_entries(session, token, params, existing_ids):
     """Fetch all entries by paginating until no new data is found."""
     all_entries = []
-    page = 1
+    for _, new_entries in iter_new_entries(session, token, params, existing_ids):
+        all_entries.extend(new_entries)
+    return all_entries
+
+def replay_archive(targets, store):
+    """Rebuild every archived entry of `targets` (HTTP_ARCHIVE=replay) and save it.
     
-    # Backfill mode: If True, we don't stop when we hit an existing ID.
-    # We continue fetching until the API returns nothing.
-    force_backfill = os.environ.get("BACKFILL", "false").lower() == "true"
+    Media already downloaded and cached translations are reused, so this
+    sends no requests to the site. Notion sync state is left as it is for
+    entries already stored; ones new to the store are queued for upload.
+    Returns the number of entries rebuilt.
+    """
+    rebuilt = 0
+    for target in targets:
+        print(f"Replaying target: {target['name']}")
+        for _, entries in iter_new_entries(None, None, target["params"], set()):
+            store.add_raw_entries(entries)
+            with stage("process"):
+                processed = process_and_save(entries, store=store, reprocess=True)
+            new_ids = {str(entry["id"]) for entry in processed if entry["id"] not in store}
+            store.add_entries([entry for entry in processed if str(entry["id"]) not in new_ids])
+            store.add_entries(
+                [entry for entry in processed if str(entry["id"]) in new_ids], notion_status=NOTION_PENDING
+            )
+            rebuilt += len(processed)
+    return rebuilt
+
+def _prepare_chunk(entries):
+    return [prepare_entry(entry) for entry in entries]
+
+def _build_chunk(args):
+    items, downloaded, web_files = args
+    return [
+        build_entry(prepared, translated_text, downloaded, web_files, now=now, timestamp=timestamp)
+        for prepared, translated_text, now, timestamp in items
+    ]
+
+def rerender_entries(store, id_from=None, id_to=None, workers=None):
+    """Rebuild stored entries with ids in [id_from, id_to] from their raw API records.
     
-    if force_backfill:
-        print("BACKFILL mode enabled: Will scan all pages despite existing data.")
+    Only ids that are already stored are rebuilt; unprocessed raw records
+    and member-only placeholders are skipped.
     
-    while True:
-        entries = fetch_diary_entries(session, token, params, page)
-        if not entries:
-            print("No more entries found. Stopping pagination.")
-            break
-            
-        new_items_on_page = 0
-        total_items = len(entries)
-        
-        for entry in entries:
-            diary_id = str(entry.get("c_diary_id"))
+    Parsing and block building run in a pool of RERENDER_WORKERS processes;
+    translation and media go through the usual caches in this process, so
+    only segments and files that are missing cost a request. Stored
+    timestamps are kept, and Notion sync state is left as it is. Returns
+    the number of entries re-rendered.
+    """
+    workers = max(1, workers or RERENDER_WORKERS)
+    raw_entries = store.iter_raw_entries(id_from, id_to)
+    rendered_count = 0
+    # spawn: never fork a process that may hold locks in other threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        while True:
+            batch = [raw for _, raw in zip(range(RERENDER_BATCH), raw_entries)]
+            if not batch:
+                break
+            print(f"Re-rendering {len(batch)} entries ({workers} processes)...")
+            entries = [entry for entry, _ in batch]
+            fetched = {str(entry.get("c_diary_id")): fetched_at for entry, fetched_at in batch}
+            timestamps = store.get_timestamps(fetched)
             
-            if diary_id in existing_ids:
-                # Skip duplicate
-                continue
+            chunks = [entries[i:i + RERENDER_CHUNK] for i in range(0, len(entries), RERENDER_CHUNK)]
+            with stage("prepare"):
+                prepared = [p for chunk in pool.map(_prepare_chunk, chunks) for p in chunk]
+            translated_texts, downloaded, web_files = fetch_resources(prepared)
             
-            all_entries.append(entry)
-            new_items_on_page += 1
+            items = []
+            for p, translated_text in zip(prepared, translated_texts):
+                diary_id = str(p[0].get("c_diary_id"))
+                # Years are inferred relative to when the record was fetched, not today
+                now = datetime.fromtimestamp(fetched[diary_id] or time.time(), JST)
+                items.append((p, translated_text, now, timestamps.get(diary_id)))
+            tasks = [(items[i:i + RERENDER_CHUNK], downloaded, web_files) for i in range(0, len(items), RERENDER_CHUNK)]
+            with stage("build"):
+                rendered = [entry for chunk in pool.map(_build_chunk, tasks) for entry in chunk]
             
-        print(f"Page {page}: Found {new_items_on_page} new entries out of {total_items}.")
-        
-        # Stop Condition for Standard Mode
-        if not force_backfill:
-            if new_items_on_page == 0:
-                print("No new entries found on this page. Stopping pagination.")
+            store.add_entries(rendered)
+            save_translation_cache()
+            rendered_count += len(rendered)
+    return rendered_count
+
+def _run_stage(name, handle, inbox, outbox):
+    """Feed items from `inbox` through `handle`, passing its results on to `outbox`.
+    
+    A None item marks the end of the stream and is forwarded downstream. If
+    `handle` fails, the error is reported and the stage keeps draining its
+    inbox so upstream stages never block on a full queue.
+    """
+    failed = False
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        if failed:
+            continue
+        try:
+            for result in handle(item):
+                outbox.put(result)
+        except Exception as e:
+            print(f"Pipeline stage '{name}' failed: {e}")
+            failed = True
+    outbox.put(None)
+
+def process_batch(batch, session, store):
+    """Process a batch of raw entries and save them as pending Notion upload; returns the new entries."""
+    with stage("process"):
+        new_data = process_and_save(batch, session=session, store=store)
+    # Save as pending before uploading (in one transaction), so a crash leaves them pending instead of re-processed
+    store.add_entries(new_data, notion_status=NOTION_PENDING)
+    return new_data
+
+class _KnownIds:
+    """Ids that need no processing: stored entries, and member-only ones queued as locked."""
+    
+    def __init__(self, store):
+        self.store = store
+    
+    def __contains__(self, diary_id):
+        return diary_id in self.store or self.store.is_locked(diary_id)
+
+class _FetchedIds(_KnownIds):
+    """Ids already fetched: known ones, or raw records waiting for process_raw."""
+    
+    def __contains__(self, diary_id):
+        return super().__contains__(diary_id) or self.store.has_raw_entry(diary_id)
+
+def fetch_raw(session, token, targets, store, backfill=None):
+    """Store the raw records of new entries for every target, without processing them.
+    
+    Records stored by an earlier fetch count as seen, so repeated fetches
+    stop where the last one did. Returns the number of records stored.
+    """
+    fetched = 0
+    for target in targets:
+        print(f"Following target: {target['name']}")
+        params = target["params"]
+        for _, new_entries in iter_new_entries(session, token, params, _FetchedIds(store),
+                                               cursor=store.get_cursor(params_key(params)), backfill=backfill):
+            store.add_raw_entries(new_entries)
+            fetched += len(new_entries)
+    return fetched
+
+def process_raw(store, session=None):
+    """Process the raw records fetch_raw stored, saving them as pending upload; returns the count."""
+    session = session or get_session()
+    saved = 0
+    batch = []
+    for raw in store.iter_unprocessed_raw():
+        batch.append(raw)
+        if len(batch) == PROCESS_BATCH:
+            saved += len(process_batch(batch, session, store))
+            batch = []
+    if batch:
+        saved += len(process_batch(batch, session, store))
+    return saved
+
+def refetch_locked(session, token, targets, store, force=False):
+    """Re-fetch the member-only entries queued as locked, in case the cookies now grant access.
+    
+    Each target's listing is paged only down to the oldest queued entry.
+    Entries now served in full are processed and saved as pending upload
+    (replacing a stored placeholder, whose Notion page is archived) and
+    leave the queue. One still served as a placeholder means the cookies
+    do not grant access yet: the pass stops there, and is not tried again
+    for LOCKED_RETRY_INTERVAL unless `force`. Returns the number of
+    entries recovered.
+    """
+    if not force and not store.locked_entries(checked_before=time.time() - LOCKED_RETRY_INTERVAL):
+        return 0
+    locked = store.locked_entries()
+    if not locked:
+        return 0
+    print(f"Re-fetching {len(locked)} member-only entries...")
+    oldest = min((t for t in locked.values() if t is not None), default=None)
+    limiter = TokenBucket(PAGE_RATE, capacity=1, name="pages")
+    recovered = 0
+    denied = False
+    for target in targets:
+        page = 1
+        while locked and not denied and page <= MAX_PAGES + 1:
+            limiter.acquire()
+            with stage("fetch_page"):
+                entries = fetch_diary_entries(session, token, dict(target["params"]), page)
+            if not entries:
                 break
-        
-        # Safety limit to prevent infinite loops (e.g. if logic fails)
-        if page > 100: 
-             print("Reached page 100 limit. Stopping.")
-             break
+            found = [e for e in entries if str(e.get("c_diary_id")) in locked]
+            if found:
+                store.add_raw_entries(found)
+                new_data = process_and_save(found, session=session, store=store, reprocess=True)
+                # The stored placeholder's page would otherwise stay next to the real one
+                kept = {}
+                for entry in new_data:
+                    _, page_id = store.get_notion_status(entry["id"])
+                    if page_id and not archive_page(page_id):
+                        kept[entry["id"]] = page_id
+                store.add_entries(new_data, notion_status=NOTION_PENDING)
+                for diary_id, page_id in kept.items():
+                    # Archived by sync_pending before the entry is uploaded again
+                    store.set_notion_status(diary_id, NOTION_FAILED, page_id)
+                unlocked = [str(entry["id"]) for entry in new_data]
+                store.unlock(unlocked)
+                inc("locked_entries_total", len(unlocked), result="recovered")
+                recovered += len(unlocked)
+                for entry in found:
+                    locked.pop(str(entry.get("c_diary_id")))
+                if len(unlocked) < len(found):
+                    print("Member-only entries are still locked: the cookies do not grant access yet.")
+                    denied = True
+            listed = [t for t in (parse_timestamp(e.get("create_date")) for e in entries) if t is not None]
+            if oldest is not None and listed and min(listed) < oldest:
+                break
+            page += 1
+        if denied:
+            break
+    # Whatever is left (still locked, or no longer listed) waits for the next retry
+    remaining = store.locked_entries()
+    store.check_locked(remaining)
+    print(f"Recovered {recovered} member-only entries; {len(remaining)} still locked.")
+    return recovered
 
-        page += 1
-        time.sleep(1) # Be nice to the server
-        
-    return all_entries
+def run_pipeline(session, token, targets, store, backfill=None):
+    """Stream entries through fetch → process and save → Notion upload.
+    
+    Each stage runs in its own thread, connected by bounded queues, so a
+    page's entries are saved and published as soon as they are ready
+    instead of after the whole run, and memory stays bounded by the queue
+    sizes. Entries are stored as pending before upload and checkpointed
+    with their Notion page id (or failure) as each upload completes.
+    
+    Up to TARGET_CONCURRENCY targets are paginated at once, each with its
+    own page cursor, over the shared session and under one PAGE_RATE
+    request budget. `backfill` overrides the BACKFILL environment variable.
+    Returns the number of entries saved.
+    """
+    pages = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    processed = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    uploaded = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    
+    # One request budget for every target
+    limiter = TokenBucket(PAGE_RATE, capacity=1, name="pages")
+    # (params, listing) per target, to move the cursors once everything is saved
+    listings = []
+    
+    def follow(target):
+        print(f"Following target: {target['name']}")
+        params = target["params"]
+        if GAP_SCAN and len(targets) == 1:
+            walk = iter_gap_entries(session, token, params, store, limiter=limiter)
+        elif GAP_SCAN:
+            print("Gap scan needs one target per store; scanning every page instead.")
+            walk = iter_new_entries(session, token, params, _KnownIds(store), limiter=limiter, backfill=True)
+        else:
+            listing = {}
+            listings.append((params, listing))
+            walk = iter_new_entries(session, token, params, _KnownIds(store), limiter=limiter,
+                                    cursor=store.get_cursor(params_key(params)), listing=listing,
+                                    backfill=backfill)
+        for _, new_entries in walk:
+            if new_entries:
+                pages.put(new_entries)
+    
+    def fetch():
+        with ThreadPoolExecutor(max_workers=TARGET_CONCURRENCY) as pool:
+            futures = [pool.submit(follow, target) for target in targets]
+            for target, future in zip(targets, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Pipeline stage 'fetch' failed for {target['name']}: {e}")
+        pages.put(None)
+    
+    def process(batch):
+        # Keep the original records, so the entries can be re-rendered without refetching
+        store.add_raw_entries(batch)
+        # Note: process_and_save also checks duplicates, but our fetch loop does it to save API calls
+        return [process_batch(batch, session, store)]
+    
+    def upload(batch):
+        # Pages of one batch are created concurrently, each checkpointed as it completes
+        with stage("upload"):
+            upload_and_checkpoint(batch, store)
+        return batch
+    
+    threads = [
+        threading.Thread(target=fetch, name="fetch"),
+        threading.Thread(target=_run_stage, args=("process", process, pages, processed), name="process"),
+        threading.Thread(target=_run_stage, args=("upload", upload, processed, uploaded), name="upload"),
+    ]
+    for thread in threads:
+        thread.start()
+    
+    saved = 0
+    while uploaded.get() is not None:
+        saved += 1
+    
+    for thread in threads:
+        thread.join()
+    
+    for params, listing in listings:
+        advance_cursor(store, params, listing)
+    return saved
 
-if __name__ == "__main__":
-    # 1. Setup
-    params = load_params()
+def poll_intervals(histogram, fastest=None, slowest=None):
+    """Seconds between polls for each JST hour, from the hour-of-day posting histogram.
+    
+    Each hour is smoothed with its neighbours. The poll rate follows the
+    square root of the activity, which minimizes the average delay before a
+    new post is seen for a given number of polls: the busiest hour polls
+    every `fastest` seconds, an hour with a quarter of its posts half as
+    often, and none less often than every `slowest` seconds. Intervals are
+    rounded down to a divisor of an hour (or whole hours), so the polls of
+    every hour line up with the hour itself.
+    """
+    fastest = fastest or WATCH_MIN_INTERVAL
+    slowest = slowest or WATCH_MAX_INTERVAL
+    smoothed = [histogram[h - 1] + 2 * histogram[h] + histogram[(h + 1) % 24] for h in range(24)]
+    peak = max(smoothed)
+    intervals = []
+    for count in smoothed:
+        if not peak:
+            interval = (fastest + slowest) / 2 # No history yet
+        else:
+            interval = min(slowest, fastest * (peak / count) ** 0.5) if count else slowest
+        if interval >= 3600:
+            interval = interval // 3600 * 3600
+        else:
+            interval = max([d for d in range(60, 3601, 60) if 3600 % d == 0 and d <= interval], default=interval)
+        intervals.append(interval)
+    return intervals
+
+def next_poll_delay(intervals, now=None, offset=None):
+    """Seconds until the next poll on the hour-aligned grid.
+    
+    Within each JST hour polls fall `offset` seconds past the hour and then
+    every interval of that hour; an hour whose interval is n hours long
+    polls once, if its hour of the day is a multiple of n.
+    """
+    now = now or datetime.now(JST)
+    offset = WATCH_OFFSET if offset is None else offset
+    hour_start = now.replace(minute=0, second=0, microsecond=0)
+    for _ in range(48):
+        interval = intervals[hour_start.hour]
+        if interval >= 3600:
+            points = [offset] if hour_start.hour % round(interval / 3600) == 0 else []
+        else:
+            points = [offset + k * interval for k in range(int((3600 - offset - 1) // interval) + 1)]
+        for point in points:
+            poll = hour_start + timedelta(seconds=point)
+            if poll > now:
+                return (poll - now).total_seconds()
+        hour_start += timedelta(hours=1)
+    return intervals[now.hour]
+
+def watch(targets):
+    """Poll for new entries until stopped (SIGTERM or Ctrl-C).
+    
+    The session, CSRF token, store and in-memory caches (translations,
+    media manifest) stay warm between polls. Polls are spaced by the
+    posting history in the store (poll_intervals), and the next poll comes
+    early after one that found new entries, since posts tend to come in runs.
+    Metrics are written after every poll.
+    """
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    
     session = get_session()
+    if not get_csrf_token(session):
+        return
+    with EntryStore() as store:
+        try:
+            while not stopping.is_set():
+                saved = 0
+                try:
+                    with stage("poll"):
+                        saved = run_pipeline(session, session.csrf_token, targets, store)
+                        if os.environ.get("YOASOBI_COOKIES"):
+                            saved += refetch_locked(session, session.csrf_token, targets, store)
+                        sync_pending(store)
+                    save_session_cache(session)
+                except Exception as e:
+                    print(f"Poll failed: {e}")
+                write_reports()
+                
+                delay = next_poll_delay(poll_intervals(store.hour_histogram()))
+                if saved:
+                    delay = min(delay, WATCH_MIN_INTERVAL)
+                print(f"{saved} new entries. Next poll in {delay / 60:.1f} min "
+                      f"({(datetime.now(JST) + timedelta(seconds=delay)):%H:%M} JST)")
+                stopping.wait(delay)
+        except KeyboardInterrupt:
+            pass
+    save_session_cache(session)
+    print("Watch stopped.")
+
+def run_once(targets, backfill=None):
+    """One scheduled run: fetch → process → upload every target, then catch up on Notion.
+    
+    With HTTP_ARCHIVE=replay the archive is rebuilt offline instead.
+    Returns False if no CSRF token could be obtained.
+    """
+    if is_replaying():
+        # Network-free rebuild of the archive with the current processing code
+        with EntryStore() as store:
+            print(f"Rebuilt {replay_archive(targets, store)} entries from the HTTP archive.")
+        return True
     
-    # 2. Auth
+    session = get_session()
+    
+    # Auth
     token = get_csrf_token(session)
     if not token:
-        exit(1)
+        return False
 
-    # Load existing IDs to know when to stop
-    existing_ids = set()
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, "r") as f:
-                old_data = json.load(f)
-                existing_ids = set(str(item["id"]) for item in old_data)
-        except:
-            pass
-        
-    # 3. Fetch All
-    entries = fetch_all_entries(session, token, params, existing_ids)
+    # Existing IDs (indexed lookups in the store) tell us when to stop
+    store = EntryStore()
     
-    # 4. Process (Download & Translate)
-    # Note: process_and_save also checks duplicates, but our fetch loop does it to save API calls
-    new_data = process_and_save(entries, session=session)
+    # Fetch → Process (Download & Translate) → Save → Upload to Notion, streamed page by page
+    with stage("pipeline"):
+        saved = run_pipeline(session, token, targets, store, backfill=backfill)
     
-    if new_data:
-        print(f"Successfully processed {len(new_data)} new entries.")
-        
-        # 5. Upload to Notion
-        upload_to_notion(new_data)
-        
-        # Append to data store
-        all_data = []
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r") as f:
-                all_data = json.load(f)
-        
-        all_data.extend(new_data)
-        
-        with open(DATA_FILE, "w", encoding='utf-8') as f:
-            json.dump(all_data, f, ensure_ascii=False, indent=2)
-            
-        print(f"Saved data to {DATA_FILE}")
+    if saved:
+        print(f"Successfully processed {saved} new entries.")
+        print(f"Saved data to {DB_FILE}")
     else:
         print("No new entries found.")
+    
+    # Member-only entries served as placeholders get another try, with the cookies of this run
+    if os.environ.get("YOASOBI_COOKIES"):
+        with stage("refetch_locked"):
+            refetch_locked(session, token, targets, store)
+    
+    # Catch up on Notion: full reconcile on request, otherwise retry earlier failures
+    with stage("notion_catch_up"):
+        if os.environ.get("NOTION_RECONCILE", "false").lower() == "true":
+            reconcile_notion(store)
+        else:
+            sync_pending(store)
+    
+    store.close()
+    save_session_cache(session)
+    
+    print("HTTP requests by host:")
+    session.print_stats()
+    return True
+
+if __name__ == "__main__":
+    # Kept for existing jobs: the commands live in main.py (python scraper.py [watch|rerender ...] still works)
+    from main import main
+    sys.exit(main())
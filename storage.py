@@ -0,0 +1,465 @@
+import os
+import sys
+import gzip
+import sqlite3
+import zlib
+import time
+import threading
+from codec import dumps, loads
+from parsing import MEMBER_ONLY_MARKERS, is_member_only
+
+DB_FILE = "data_store.db"
+# Legacy archive, imported once into DB_FILE the first time the store is opened
+LEGACY_JSON_FILE = "data_store.json"
+
+ENTRY_FIELDS = [
+    "id", "date", "title", "original_text", "translated_text",
+    "cover_filename", "cover_type", "image_url_original", "timestamp",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id TEXT PRIMARY KEY,
+    date TEXT,
+    title TEXT,
+    original_text TEXT,
+    translated_text TEXT,
+    cover_filename TEXT,
+    cover_type TEXT,
+    image_url_original TEXT,
+    timestamp REAL
+);
+CREATE INDEX IF NOT EXISTS entries_timestamp ON entries (timestamp);
+
+CREATE TABLE IF NOT EXISTS content_blocks (
+    entry_id TEXT NOT NULL REFERENCES entries (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    filename TEXT,
+    url TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (entry_id, position)
+);
+CREATE INDEX IF NOT EXISTS content_blocks_filename ON content_blocks (filename);
+
+CREATE TABLE IF NOT EXISTS notion_sync (
+    entry_id TEXT PRIMARY KEY REFERENCES entries (id) ON DELETE CASCADE,
+    status TEXT NOT NULL,
+    page_id TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS notion_sync_status ON notion_sync (status);
+
+-- Per target (http_archive.params_key): newest listed entry at and below which everything is stored
+CREATE TABLE IF NOT EXISTS cursors (
+    target TEXT PRIMARY KEY,
+    entry_id TEXT NOT NULL,
+    timestamp REAL,
+    updated REAL
+);
+
+-- Original API records (zlib-compressed JSON), kept so entries can be re-rendered offline
+CREATE TABLE IF NOT EXISTS raw_entries (
+    entry_id TEXT PRIMARY KEY,
+    payload BLOB NOT NULL,
+    fetched REAL
+);
+
+-- Member-only entries the site served as a placeholder (cookies missing or expired), queued for a re-fetch
+CREATE TABLE IF NOT EXISTS locked_entries (
+    entry_id TEXT PRIMARY KEY,
+    timestamp REAL,
+    detected REAL,
+    checked REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Notion upload states recorded per entry (entries without a row predate tracking)
+NOTION_PENDING = "pending"
+NOTION_UPLOADED = "uploaded"
+NOTION_FAILED = "failed"
+# Page created but not all of its blocks appended yet; the page id is kept so it can be archived
+NOTION_PARTIAL = "partial"
+# pages.create timed out or got a 5xx: the page may exist, so it is looked up before creating another
+NOTION_UNCONFIRMED = "unconfirmed"
+
+class EntryStore:
+    """SQLite-backed archive of processed entries.
+
+    Entries are keyed by diary id with a timestamp index; each entry's
+    content_blocks live in their own table, in order. `id in store` is a
+    primary-key lookup, so callers never need to load the whole archive.
+    One store may be shared between pipeline threads.
+    """
+
+    def __init__(self, path=DB_FILE, legacy_json=LEGACY_JSON_FILE):
+        is_new = not os.path.exists(path)
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        has_locked = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'locked_entries'"
+        ).fetchone()
+        self.conn.executescript(SCHEMA)
+        if is_new and legacy_json and os.path.exists(legacy_json):
+            self.import_json(legacy_json)
+        if not has_locked:
+            # One-time migration: placeholders saved before they were detected join the queue
+            self.queue_stored_placeholders()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, diary_id):
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM entries WHERE id = ?", (str(diary_id),)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def add_entries(self, entries, notion_status=None):
+        """Insert or replace entries and their content blocks in one transaction.
+
+        With `notion_status`, each entry's Notion upload state is set to it
+        (without a page id) in the same transaction.
+        """
+        with self.lock, self.conn:
+            for entry in entries:
+                diary_id = str(entry["id"])
+                # Upsert rather than REPLACE, which would cascade-delete the entry's sync state
+                self.conn.execute(
+                    f"INSERT INTO entries ({', '.join(ENTRY_FIELDS)}) "
+                    f"VALUES ({', '.join('?' for _ in ENTRY_FIELDS)}) "
+                    f"ON CONFLICT (id) DO UPDATE SET "
+                    f"{', '.join(f'{field} = excluded.{field}' for field in ENTRY_FIELDS[1:])}",
+                    [diary_id] + [entry.get(field) for field in ENTRY_FIELDS[1:]],
+                )
+                self.conn.execute("DELETE FROM content_blocks WHERE entry_id = ?", (diary_id,))
+                self.conn.executemany(
+                    "INSERT INTO content_blocks (entry_id, position, type, filename, url, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (diary_id, position, block.get("type"), block.get("filename"), block.get("url"),
+                         dumps(block))
+                        for position, block in enumerate(entry.get("content_blocks", []))
+                    ],
+                )
+                if notion_status:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO notion_sync (entry_id, status, page_id, updated) "
+                        "VALUES (?, ?, NULL, ?)",
+                        (diary_id, notion_status, time.time()),
+                    )
+
+    def _with_blocks(self, rows):
+        entries = [dict(zip(ENTRY_FIELDS, row)) for row in rows]
+        by_id = {}
+        for entry in entries:
+            entry["content_blocks"] = []
+            by_id[entry["id"]] = entry
+        if by_id:
+            placeholders = ", ".join("?" for _ in by_id)
+            for entry_id, data in self.conn.execute(
+                f"SELECT entry_id, data FROM content_blocks WHERE entry_id IN ({placeholders}) "
+                "ORDER BY entry_id, position",
+                list(by_id),
+            ):
+                by_id[entry_id]["content_blocks"].append(loads(data))
+        return entries
+
+    def get_entry(self, diary_id):
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(ENTRY_FIELDS)} FROM entries WHERE id = ?", (str(diary_id),)
+            ).fetchall()
+            entries = self._with_blocks(rows)
+        return entries[0] if entries else None
+
+    def iter_entries(self, batch_size=500):
+        """Yield all entries, newest first, loading `batch_size` at a time."""
+        offset = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT {', '.join(ENTRY_FIELDS)} FROM entries "
+                    "ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+                    (batch_size, offset),
+                ).fetchall()
+                entries = self._with_blocks(rows)
+            if not entries:
+                break
+            yield from entries
+            offset += len(entries)
+
+    def set_notion_status(self, diary_id, status, page_id=None):
+        """Checkpoint an entry's Notion upload state (committed immediately)."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO notion_sync (entry_id, status, page_id, updated) VALUES (?, ?, ?, ?)",
+                (str(diary_id), status, page_id, time.time()),
+            )
+
+    def get_notion_status(self, diary_id):
+        """Return (status, page_id), or (None, None) if the entry was never tracked."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, page_id FROM notion_sync WHERE entry_id = ?", (str(diary_id),)
+            ).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def entries_with_notion_status(self, *statuses):
+        """Entries whose Notion upload is in one of `statuses`, oldest first."""
+        placeholders = ", ".join("?" for _ in statuses)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join('e.' + field for field in ENTRY_FIELDS)} FROM entries e "
+                f"JOIN notion_sync n ON n.entry_id = e.id WHERE n.status IN ({placeholders}) "
+                "ORDER BY e.timestamp, e.id",
+                statuses,
+            ).fetchall()
+            return self._with_blocks(rows)
+
+    def get_cursor(self, target):
+        """Return the target's (entry_id, timestamp) high-water mark, or (None, None)."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT entry_id, timestamp FROM cursors WHERE target = ?", (target,)
+            ).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def set_cursor(self, target, entry_id, timestamp):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cursors (target, entry_id, timestamp, updated) VALUES (?, ?, ?, ?)",
+                (target, str(entry_id), timestamp, time.time()),
+            )
+
+    def hour_histogram(self, utc_offset=9 * 3600):
+        """Number of entries posted in each hour of the day (JST by default)."""
+        histogram = [0] * 24
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT CAST(strftime('%H', timestamp + ?, 'unixepoch') AS INTEGER) AS hour, COUNT(*) "
+                "FROM entries WHERE timestamp IS NOT NULL GROUP BY hour",
+                (utc_offset,),
+            ).fetchall()
+        for hour, count in rows:
+            histogram[hour] = count
+        return histogram
+
+    def count_between(self, oldest, newest):
+        """Number of entries with oldest <= timestamp <= newest, counting queued locked ones too."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT (SELECT COUNT(*) FROM entries WHERE timestamp BETWEEN ?1 AND ?2) + "
+                "(SELECT COUNT(*) FROM locked_entries WHERE timestamp BETWEEN ?1 AND ?2 "
+                "AND entry_id NOT IN (SELECT id FROM entries))",
+                (oldest, newest),
+            ).fetchone()[0]
+
+    def add_raw_entries(self, raw_entries, fetched=None):
+        """Keep the original API records (compressed), replacing earlier copies."""
+        fetched = fetched or time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO raw_entries (entry_id, payload, fetched) VALUES (?, ?, ?)",
+                [
+                    (str(raw["c_diary_id"]),
+                     zlib.compress(dumps(raw).encode("utf-8"), 9),
+                     fetched)
+                    for raw in raw_entries
+                ],
+            )
+
+    def get_raw_entry(self, diary_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT payload FROM raw_entries WHERE entry_id = ?", (str(diary_id),)
+            ).fetchone()
+        return loads(zlib.decompress(row[0])) if row else None
+
+    def has_raw_entry(self, diary_id):
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM raw_entries WHERE entry_id = ?", (str(diary_id),)).fetchone()
+        return row is not None
+
+    def iter_unprocessed_raw(self, batch_size=500):
+        """Yield raw records that have no processed entry yet (and are not locked), in the order they were stored."""
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT r.rowid, r.payload FROM raw_entries r LEFT JOIN entries e ON e.id = r.entry_id "
+                    "WHERE e.id IS NULL AND r.rowid > ? "
+                    "AND r.entry_id NOT IN (SELECT entry_id FROM locked_entries) ORDER BY r.rowid LIMIT ?",
+                    (last, batch_size),
+                ).fetchall()
+            if not rows:
+                break
+            for rowid, payload in rows:
+                yield loads(zlib.decompress(payload))
+            last = rows[-1][0]
+
+    def iter_raw_entries(self, id_from=None, id_to=None, batch_size=500):
+        """Yield (raw entry, fetched time) for stored diary ids in [id_from, id_to], in id order.
+        
+        Only records that already have an entry are yielded: raw records that
+        were fetched but not processed yet, and member-only placeholders, are
+        left to the normal processing path.
+        """
+        where = [
+            "entry_id IN (SELECT id FROM entries)",
+            "entry_id NOT IN (SELECT entry_id FROM locked_entries)",
+        ]
+        args = []
+        if id_from is not None:
+            where.append("CAST(entry_id AS INTEGER) >= ?")
+            args.append(int(id_from))
+        if id_to is not None:
+            where.append("CAST(entry_id AS INTEGER) <= ?")
+            args.append(int(id_to))
+        query = (
+            "SELECT payload, fetched FROM raw_entries "
+            f"WHERE {' AND '.join(where)} "
+            "ORDER BY CAST(entry_id AS INTEGER) LIMIT ? OFFSET ?"
+        )
+        offset = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(query, args + [batch_size, offset]).fetchall()
+            if not rows:
+                break
+            for payload, fetched in rows:
+                yield loads(zlib.decompress(payload)), fetched
+            offset += len(rows)
+
+    def get_timestamps(self, diary_ids):
+        """Map each stored diary id in `diary_ids` to its timestamp."""
+        timestamps = {}
+        ids = [str(i) for i in diary_ids]
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ", ".join("?" for _ in chunk)
+                timestamps.update(self.conn.execute(
+                    f"SELECT id, timestamp FROM entries WHERE id IN ({placeholders})", chunk
+                ).fetchall())
+        return timestamps
+
+    def queue_stored_placeholders(self):
+        """Queue stored entries that are only the member-only placeholder; returns how many.
+
+        Candidates are picked in SQL, so the archive is never loaded.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, original_text, timestamp FROM entries WHERE "
+                + " OR ".join("original_text LIKE ?" for _ in MEMBER_ONLY_MARKERS),
+                [f"%{marker}%" for marker in MEMBER_ONLY_MARKERS],
+            ).fetchall()
+        stale = [(diary_id, timestamp) for diary_id, text, timestamp in rows if is_member_only(text)]
+        if stale:
+            self.add_locked(stale)
+        return len(stale)
+
+    def add_locked(self, rows, detected=None):
+        """Queue member-only entries, given as (entry_id, timestamp) pairs; queued ones keep their state."""
+        detected = detected or time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO locked_entries (entry_id, timestamp, detected) VALUES (?, ?, ?) "
+                "ON CONFLICT (entry_id) DO UPDATE SET timestamp = COALESCE(excluded.timestamp, timestamp)",
+                [(str(entry_id), timestamp, detected) for entry_id, timestamp in rows],
+            )
+
+    def locked_entries(self, checked_before=None):
+        """Map queued member-only entry ids to their timestamp.
+
+        With `checked_before`, only entries not re-fetched since then are returned.
+        """
+        query = "SELECT entry_id, timestamp FROM locked_entries"
+        args = ()
+        if checked_before is not None:
+            query += " WHERE checked IS NULL OR checked < ?"
+            args = (checked_before,)
+        with self.lock:
+            return dict(self.conn.execute(query, args).fetchall())
+
+    def is_locked(self, diary_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM locked_entries WHERE entry_id = ?", (str(diary_id),)
+            ).fetchone()
+        return row is not None
+
+    def check_locked(self, diary_ids, checked=None):
+        """Record a re-fetch attempt that found these entries still locked."""
+        checked = checked or time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE locked_entries SET checked = ?, attempts = attempts + 1 WHERE entry_id = ?",
+                [(checked, str(i)) for i in diary_ids],
+            )
+
+    def unlock(self, diary_ids):
+        """Drop entries from the member-only queue (their full content was fetched)."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM locked_entries WHERE entry_id = ?", [(str(i),) for i in diary_ids]
+            )
+
+    def referenced_files(self):
+        """Map every media filename the archive points at (covers, blocks, web copies) to its entry ids."""
+        refs = {}
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT cover_filename, id FROM entries WHERE cover_filename IS NOT NULL "
+                "UNION SELECT filename, entry_id FROM content_blocks WHERE filename IS NOT NULL "
+                "UNION SELECT json_extract(data, '$.web_filename'), entry_id FROM content_blocks "
+                "WHERE json_extract(data, '$.web_filename') IS NOT NULL"
+            ).fetchall()
+        for filename, entry_id in rows:
+            refs.setdefault(filename, set()).add(entry_id)
+        return refs
+
+    def import_json(self, path):
+        """One-shot import of a data_store.json-style list of entries (.json or .json.gz)."""
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            entries = loads(f.read())
+        self.add_entries(entries)
+        print(f"Imported {len(entries)} entries from {path} into {self.path}")
+
+    def export_json(self, path):
+        """Write the archive back out in the data_store.json format.
+
+        The output is compact, one entry per line, and streamed a batch at a
+        time rather than built in memory; a .gz path is gzip-compressed.
+        """
+        opener = gzip.open if path.endswith(".gz") else open
+        count = 0
+        tmp_path = f"{path}.tmp"
+        with opener(tmp_path, "wb") as f:
+            f.write(b"[")
+            for entry in self.iter_entries():
+                f.write((",\n" if count else "\n").encode("utf-8"))
+                f.write(dumps(entry).encode("utf-8"))
+                count += 1
+            f.write(b"\n]\n")
+        os.replace(tmp_path, path)
+        print(f"Exported {count} entries to {path}")
+
+if __name__ == "__main__":
+    # Kept for existing jobs: the commands live in main.py (python storage.py import|export <file> still works)
+    from main import main
+    sys.exit(main())
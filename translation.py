@@ -0,0 +1,193 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ratelimit import TokenBucket, backoff_delay
+from metrics import inc
+from codec import dumps, loads
+
+SOURCE_LANG = "auto"
+TARGET_LANG = "zh-CN"
+
+# On-disk segment cache, committed alongside data_store.json so CI runs share it
+TRANSLATION_CACHE_FILE = "translation_cache.json"
+TRANSLATION_CACHE_SIZE = int(os.environ.get("TRANSLATION_CACHE_SIZE", "20000"))
+
+# GoogleTranslator rejects payloads over 5000 characters
+MAX_REQUEST_CHARS = 4500
+
+# Batched translation: parallel requests, requests per second, retries per chunk
+TRANSLATION_WORKERS = int(os.environ.get("TRANSLATION_WORKERS", "3"))
+TRANSLATION_RATE = float(os.environ.get("TRANSLATION_RATE", "5"))
+TRANSLATION_RETRIES = 3
+
+# Decorative runs (♡••┈┈┈┈••♡ borders, emoji strings, newlines) separate segments
+# and are copied through as-is; the text between them is split into sentences.
+_DECORATION_RE = re.compile(r"(\n|[^\w\n]{3,})")
+_SENTENCE_RE = re.compile(r"[^。！？!?]*[。！？!?]+|[^。！？!?]+")
+_WORD_RE = re.compile(r"[^\W\d_]")
+
+_rate_limiter = TokenBucket(TRANSLATION_RATE, name="translation")
+# GoogleTranslator keeps per-request state on the instance, so each worker thread gets its own
+_local = threading.local()
+_cache = None
+_cache_dirty = False
+
+def get_translator():
+    """Return this thread's translator instance."""
+    if not hasattr(_local, "translator"):
+        # Imported on first use: deep_translator (and its bs4 stack) is slow to load
+        from deep_translator import GoogleTranslator
+        _local.translator = GoogleTranslator(source=SOURCE_LANG, target=TARGET_LANG)
+    return _local.translator
+
+def _cache_key(segment):
+    return hashlib.sha1(f"{TARGET_LANG}\0{segment}".encode("utf-8")).hexdigest()
+
+def load_translation_cache():
+    """Load the segment cache from disk (once per process)."""
+    global _cache
+    if _cache is None:
+        _cache = {}
+        if os.path.exists(TRANSLATION_CACHE_FILE):
+            try:
+                with open(TRANSLATION_CACHE_FILE, "rb") as f:
+                    _cache = loads(f.read())
+            except Exception as e:
+                print(f"Error loading translation cache: {e}")
+    return _cache
+
+def save_translation_cache():
+    """Write the segment cache back to disk if it changed, evicting the least recently used."""
+    global _cache_dirty
+    if _cache is None or not _cache_dirty:
+        return
+    while len(_cache) > TRANSLATION_CACHE_SIZE:
+        del _cache[next(iter(_cache))]
+    tmp_path = f"{TRANSLATION_CACHE_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(dumps(_cache))
+    os.replace(tmp_path, TRANSLATION_CACHE_FILE)
+    _cache_dirty = False
+    print(f"Saved {len(_cache)} cached translations to {TRANSLATION_CACHE_FILE}")
+
+def split_segments(text):
+    """Split text into segments whose concatenation is the original text."""
+    segments = []
+    for part in _DECORATION_RE.split(text):
+        if not part:
+            continue
+        if _DECORATION_RE.fullmatch(part):
+            segments.append(part)
+        else:
+            segments.extend(_SENTENCE_RE.findall(part))
+    return segments
+
+def is_translatable(segment):
+    """Segments without any letters (borders, emoji, numbers) are kept verbatim."""
+    return bool(_WORD_RE.search(segment))
+
+def cache_get(segment):
+    """Look up a segment, marking it as recently used."""
+    cache = load_translation_cache()
+    key = _cache_key(segment)
+    if key not in cache:
+        return None
+    value = cache[key] = cache.pop(key)
+    return value
+
+def cache_put(segment, translated):
+    global _cache_dirty
+    cache = load_translation_cache()
+    key = _cache_key(segment)
+    cache.pop(key, None)
+    cache[key] = translated
+    _cache_dirty = True
+
+def _chunk_segments(segments, limit=MAX_REQUEST_CHARS):
+    """Group segments into newline-joined chunks under the translator's size limit."""
+    chunk, size = [], 0
+    for segment in segments:
+        if chunk and size + len(segment) + 1 > limit:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(segment)
+        size += len(segment) + 1
+    if chunk:
+        yield chunk
+
+def _translate_chunk(chunk):
+    """Translate one chunk of segments, retrying with backoff.
+
+    Segments are sent newline-joined in a single request; if the
+    translator does not hand back one line per segment the chunk is
+    retried segment by segment.
+    """
+    translator = get_translator()
+    for attempt in range(TRANSLATION_RETRIES + 1):
+        try:
+            _rate_limiter.acquire()
+            inc("translation_requests_total")
+            translated = (translator.translate("\n".join(chunk)) or "").split("\n")
+            if len(translated) != len(chunk):
+                translated = []
+                for segment in chunk:
+                    _rate_limiter.acquire()
+                    inc("translation_requests_total")
+                    translated.append(translator.translate(segment) or segment)
+            return translated
+        except Exception as e:
+            if attempt == TRANSLATION_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"Translation error: {e} (retrying in {delay:.1f}s)")
+            inc("translation_retries_total")
+            time.sleep(delay)
+
+def translate_texts(texts):
+    """Translate many texts at once, returning translations in the same order.
+
+    Unseen segments of every text are deduplicated, packed into size-limited
+    chunks and translated by a small worker pool under a shared rate limit.
+    A text whose chunk still fails after retries falls back to the original
+    text, as translate_text always has.
+    """
+    segmented = [split_segments(text) if text else [] for text in texts]
+    translatable = list(dict.fromkeys(
+        s for segments in segmented for s in segments if is_translatable(s)
+    ))
+    unseen = [s for s in translatable if cache_get(s) is None]
+    inc("translation_cache_hits_total", len(translatable) - len(unseen))
+    inc("translation_cache_misses_total", len(unseen))
+
+    if unseen:
+        chunks = list(_chunk_segments(unseen))
+        print(f"Translating {len(unseen)} new segments in {len(chunks)} requests...")
+        with ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS) as pool:
+            futures = {pool.submit(_translate_chunk, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    translated = future.result()
+                except Exception as e:
+                    print(f"Translation error: {e}")
+                    continue
+                for segment, result in zip(futures[future], translated):
+                    cache_put(segment, result)
+
+    results = []
+    for text, segments in zip(texts, segmented):
+        if not text:
+            results.append("")
+            continue
+        parts = [cache_get(s) if is_translatable(s) else s for s in segments]
+        if any(part is None for part in parts):
+            results.append(text) # Fallback to original
+        else:
+            results.append("".join(parts))
+    return results
+
+def translate_text(text):
+    """Translate Japanese text to Simplified Chinese using Google Translate (Deep Translator)."""
+    return translate_texts([text])[0]
@@ -0,0 +1,100 @@
+import os
+import time
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import inc, observe
+
+# (connect, read) timeouts in seconds for every request without its own
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "60"))
+
+# Connections kept per host; should cover the concurrency we run against one host
+POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "16"))
+
+# Retries on connection errors and 5xx, with exponential backoff plus jitter
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "3"))
+RETRY_BACKOFF = 0.5
+RETRY_JITTER = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+
+class TransportSession(requests.Session):
+    """requests.Session with default timeouts and per-host latency/error counters."""
+
+    def __init__(self):
+        super().__init__()
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+        host = urlparse(url).netloc
+        start = time.monotonic()
+        try:
+            response = super().request(method, url, **kwargs)
+        except Exception:
+            self._record(host, time.monotonic() - start, error=True, status="error")
+            raise
+        self._record(host, time.monotonic() - start, error=response.status_code >= 400, status=response.status_code)
+        return response
+
+    def _record(self, host, elapsed, error, status):
+        inc("http_requests_total", host=host, status=status)
+        observe("http_request_seconds", elapsed, host=host)
+        with self._stats_lock:
+            stat = self.stats.setdefault(host, {"requests": 0, "errors": 0, "total_time": 0.0, "max_time": 0.0})
+            stat["requests"] += 1
+            stat["errors"] += int(error)
+            stat["total_time"] += elapsed
+            stat["max_time"] = max(stat["max_time"], elapsed)
+
+    def host_stats(self):
+        """Snapshot of {host: {requests, errors, total_time, max_time, avg_time}}."""
+        with self._stats_lock:
+            return {
+                host: dict(stat, avg_time=stat["total_time"] / stat["requests"] if stat["requests"] else 0.0)
+                for host, stat in self.stats.items()
+            }
+
+    def print_stats(self):
+        for host, stat in sorted(self.host_stats().items()):
+            print(
+                f"  {host}: {stat['requests']} requests, {stat['errors']} errors, "
+                f"avg {stat['avg_time'] * 1000:.0f} ms, max {stat['max_time'] * 1000:.0f} ms"
+            )
+
+def create_session(headers=None, pool_size=None):
+    """Build a pooled session that retries connection errors and 5xx responses.
+
+    The diary-list API is read-only, so POSTs are retried as well.
+    """
+    session = TransportSession()
+    if headers:
+        session.headers.update(headers)
+    retry = Retry(
+        total=HTTP_RETRIES,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        backoff_factor=RETRY_BACKOFF,
+        backoff_jitter=RETRY_JITTER,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    pool_size = pool_size or POOL_SIZE
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+_default_session = None
+_default_lock = threading.Lock()
+
+def get_default_session():
+    """Shared session for callers that were not handed one (instead of bare requests.get)."""
+    global _default_session
+    with _default_lock:
+        if _default_session is None:
+            _default_session = create_session()
+        return _default_session